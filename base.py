@@ -1,9 +1,9 @@
 import sys
 import os
-import gurobipy as gp
-from gurobipy import GRB
 from defs import *
 from util import *
+from reader import load_graph
+from instrument import Instrumentation
 from itertools import product
 
 #just a dirty global context to hold unimportant data
@@ -13,45 +13,115 @@ class gob:
 gb = gob()
 
 def main():
-    #init a gurobi model
-    m = init_model()
-    ctx = Context(m)
+    args = getattr(gb, 'args')
+    ctx = new_context()
+    stats = Instrumentation(args.profile_exprs, args.outdir)
+    for name, phase in PHASES:
+        with stats.phase(name):
+            phase(ctx)
+    #wall time, memory and model size of the run, next to results.txt
+    stats.write(ctx, os.path.join(args.outdir, 'stats.json'))
 
-    read_inputs(ctx)
-    build_correlation_classes(ctx)
+def new_context() -> Context:
+    #init an (empty) constraint system
+    problem = init_model()
+    ctx = Context(problem)
+    ctx.expression_type = expression_backends[getattr(gb, 'args').backend]
+    return ctx
+
+def select_inputs(ctx: Context):
+    select_queries(ctx, gb)
+
+def build_model(ctx: Context):
+    args = getattr(gb, 'args')
+    build_correlation_classes(ctx, use_presolve(args), args.cliques)
     build_constraints(ctx)
 
-    build_expressions(ctx)
-    build_objectives(ctx)
+def use_presolve(args) -> bool:
+    #scenarios can move a probability off 0 or 1, which would bring pruned worlds back
+    return not args.no_presolve and args.scenarios is None
 
-    #optimize each unknown (output) fact
-    print('constraint system built, dispatching to Gurobi..')
-    m.update()
+def build_all_expressions(ctx: Context):
+    args = getattr(gb, 'args')
+    mem_budget = None if args.mem_budget is None else int(args.mem_budget * 2**20)
+    #scenarios and deltas rebuild the expressions downstream of the rules they change
+    build_expressions(ctx, args.build_jobs, mem_budget, args.spill_dir,
+                      keep_all=args.scenarios is not None or args.delta is not None)
 
+def optimize(ctx: Context):
+    #optimize each unknown (output) fact
+    print(f'constraint system built, dispatching to {getattr(gb, "args").solver}..')
     run_optimize(ctx, gb)
+
+def write_results(ctx: Context):
     process_results(ctx, gb)
 
+def apply_deltas(ctx: Context):
+    args = getattr(gb, 'args')
+    if args.delta is not None:
+        run_deltas(ctx, gb, args.delta, use_presolve(args))
+
+def solve_scenarios(ctx: Context):
+    paths = getattr(gb, 'args').scenarios
+    if paths is not None:
+        run_scenarios(ctx, gb, paths)
+
 def init_model():
-    env = gp.Env(empty=False)
-    env.setParam("OutputFlag", 0)
-    env.start()
-    m = gp.Model("Baseline", env=env)
-    m.setParam('NonConvex', 2)
-    return m
+    #the problem is compiled for a solver (and NonConvex switched on if needed) in run_optimize
+    return Problem("Baseline")
 
 def read_inputs(ctx: Context):
-    read_facts(ctx, gb)
-    read_deps(ctx, gb)
+    args = getattr(gb, 'args')
+    graph = load_graph(args.testdir, not args.no_cache)
+    read_facts(ctx, graph)
+    read_deps(ctx, graph)
 
-if __name__ == "__main__":
-    import time
-    start_time = time.perf_counter()
+#the pipeline run by main, in order. named so the phases can be timed separately (see bench.py)
+PHASES = [
+    ('read', read_inputs),
+    ('select', select_inputs),
+    ('constraints', build_model),
+    ('expressions', build_all_expressions),
+    ('objectives', build_objectives),
+    ('optimize', optimize),
+    ('results', write_results),
+    ('deltas', apply_deltas),
+    ('scenarios', solve_scenarios),
+]
+
+def make_parser(description: str = 'Solve queries using constraint optimization', outdir: bool = True):
     import argparse
-    
-    parser = argparse.ArgumentParser(description='Solve queries using constraint optimization')
+
+    parser = argparse.ArgumentParser(description=description)
     parser.add_argument('--testdir', metavar='path', required=True, help='directory containing the graph artifacts (edges.txt, facts.txt)')
-    parser.add_argument('--outdir', metavar='path', required=True, help='directory to write results to')
+    if outdir:
+        parser.add_argument('--outdir', metavar='path', required=True, help='directory to write results to')
+    parser.add_argument('--no-cache', nargs='?', default=False, const=True, required=False, help='always re-parse the graph artifacts instead of going through the binary cache in <testdir>/.parsed')
     parser.add_argument('--printexprs', nargs='?', default=False, const=True, required=False, help='print arithmetic DNF for each solved query')
+    parser.add_argument('--backend', choices=list(expression_backends), default='dict', required=False, help='representation used for arithmetic DNFs (default: dict)')
+    parser.add_argument('--query', metavar='facts', default=None, required=False, help='comma separated output facts to solve for, only the part of the program they depend on is built (default: all output facts)')
+    parser.add_argument('--solver', choices=list(solver_backends), default='gurobi', required=False, help='solver backend, highs only handles linear objectives (default: gurobi)')
+    parser.add_argument('--monolithic', nargs='?', default=False, const=True, required=False, help='solve every objective on the full model instead of on the submodel of the correlation classes it uses')
+    parser.add_argument('--build-jobs', type=int, default=1, required=False, help='number of worker processes to build independent expressions on (default: 1)')
+    parser.add_argument('--mem-budget', type=float, default=None, required=False, help='MiB of expressions to keep in memory while building, the rest are spilled to disk (default: no limit)')
+    parser.add_argument('--spill-dir', default=None, required=False, help='directory to spill expressions to under --mem-budget (default: a temporary directory)')
+    parser.add_argument('--jobs', type=int, default=1, required=False, help='number of worker processes to solve the min/max problems on (default: 1)')
+    parser.add_argument('--cliques', nargs='?', default=False, const=True, required=False, help='split each correlation class into the joint tables of a junction tree over its dependencies, instead of one table of 2^n worlds')
+    parser.add_argument('--no-presolve', nargs='?', default=False, const=True, required=False, help='create sym vars for every world, including the ones the inputs force to probability 0')
+    parser.add_argument('--no-factorize', nargs='?', default=False, const=True, required=False, help='send every multilinear objective to the global solver, even when it factors across its correlation classes')
+    parser.add_argument('--time-limit', type=float, default=None, required=False, help='seconds per min/max solve, a solve out of time reports a sound outer bound and its interval is marked relaxed in results.txt (default: no limit)')
+    parser.add_argument('--run-time-limit', type=float, default=None, required=False, help='seconds for all the solves together, shared out evenly over the ones still to go (default: no limit)')
+    parser.add_argument('--rounds', type=int, default=1, required=False, help='solve in this many rounds of doubling time limits, each retrying only the relaxed intervals (default: 1)')
+    parser.add_argument('--early-stop', nargs='?', default=False, const=True, required=False, help='skip the max problem when the min already meets a trivially known upper bound')
+    parser.add_argument('--delta', metavar='path', nargs='+', default=None, required=False, help='delta files (or directories of them) adding and removing facts and rules, applied in order to the built model after the base run, with the intervals they change in <outdir>/deltas.txt')
+    parser.add_argument('--scenarios', metavar='path', nargs='+', default=None, required=False, help='scenario files (or directories of them) with new fact/rule probabilities, re-solved on the same model after the base run, one row each in <outdir>/scenarios.txt')
+    parser.add_argument('--profile-exprs', choices=['cprofile', 'tracemalloc'], default=None, required=False, help='run the expression builder under cProfile (dumped to <outdir>/expressions.prof) or tracemalloc, and add the top entries to stats.json')
+    return parser
+
+if __name__ == "__main__":
+    import time
+    start_time = time.perf_counter()
+    parser = make_parser()
     args = parser.parse_args()
 
     if not os.path.exists(args.outdir):
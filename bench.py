@@ -0,0 +1,130 @@
+import os
+import sys
+import json
+import time
+import resource
+import tempfile
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from gen import Workload, write_workload
+import base
+
+# benchmark harness, runs the phases of base.py (base.PHASES) over a grid of generated
+#   workloads (see gen.py) and records the wall time and peak memory of every phase
+#
+# every run gets a fresh process, so that one run's memory doesn't leak into the next. the
+#   first backend of a grid point is the reference the other backends are checked against,
+#   and --reference checks all runs against those of an earlier benchmark file
+
+#allowed difference between the bounds of two runs
+RESULT_TOL = 1e-6
+
+def run_phases(test_dir: str, argv: list[str], trace_memory: bool) -> dict:
+    """runs base.py's phases on test_dir in this process, returns the measurements and results"""
+    import tracemalloc
+    import contextlib
+
+    out_dir = tempfile.mkdtemp(prefix='bench-out-')
+    setattr(base.gb, 'args', base.make_parser().parse_args(['--testdir', test_dir, '--outdir', out_dir, '--no-cache'] + argv))
+
+    phases = dict[str, dict]()
+    if trace_memory:
+        tracemalloc.start()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        ctx = base.new_context()
+        for name, phase in base.PHASES:
+            if trace_memory:
+                tracemalloc.reset_peak()
+            start = time.perf_counter()
+            phase(ctx)
+            phases[name] = {'time': time.perf_counter() - start}
+            if trace_memory:
+                phases[name]['peak_mib'] = tracemalloc.get_traced_memory()[1] / 2**20
+
+    return {
+        'phases': phases,
+        #ru_maxrss is in KiB on linux
+        'max_rss_mib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        #the world vars of the classes and of their clique tables, as in stats.json
+        'sym_vars': sum(len(t.sym_vars) for cl in ctx.correlation_classes for t in [cl] + ctx.clique_tables.get(cl, [])),
+        'vars': ctx.problem.num_vars(),
+        'results': {k: [float(v[0]), float(v[1])] for k, v in ctx.results.items()},
+    }
+
+def parse_grid(specs: list[str]) -> list[dict]:
+    """'classes=2,4 depth=3' -> every combination of the listed Workload parameters"""
+    defaults = Workload().params()
+    axes = dict[str, list]()
+    for spec in specs:
+        key, _, values = spec.partition('=')
+        key = key.replace('-', '_')
+        if key not in defaults:
+            sys.exit(f'unknown workload parameter {key}, one of: {", ".join(defaults)}')
+        axes[key] = [type(defaults[key])(v) for v in values.split(',')]
+    return [dict(zip(axes, point)) for point in itertools.product(*axes.values())]
+
+def diff_results(r1: dict, r2: dict) -> list[str]:
+    """facts whose bounds differ between two runs"""
+    return [k for k in r2 if k not in r1 or any(abs(a - b) > RESULT_TOL for a, b in zip(r1[k], r2[k]))]
+
+def run_key(run: dict) -> str:
+    return json.dumps([run['params'], run['argv']], sort_keys=True)
+
+def main(args):
+    points = parse_grid(args.grid)
+    configs = [['--backend', b, '--solver', args.solver] + args.base_args.split() for b in args.backends.split(',')]
+    reference = dict[str, dict]()
+    if args.reference is not None:
+        with open(args.reference) as f:
+            reference = {run_key(r): r for r in json.load(f)['runs']}
+
+    runs = list[dict]()
+    failed = False
+    print(f'{"point":<40} {"backend":>8} ' + ' '.join(f'{name:>12}' for name, _ in base.PHASES) + f' {"rss MiB":>9}  check')
+    for point in points:
+        w = Workload(**point)
+        with tempfile.TemporaryDirectory() as test_dir:
+            write_workload(w, test_dir)
+            first = None
+            for argv in configs:
+                #one process per run, so that peak memory is measured from a clean slate
+                with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+                    run = pool.submit(run_phases, test_dir, argv, not args.no_tracemalloc).result()
+                run['params'] = w.params()
+                run['argv'] = argv
+
+                mismatches = list[str]()
+                if first is None:
+                    first = run
+                else:
+                    mismatches += diff_results(run['results'], first['results'])
+                if run_key(run) in reference:
+                    mismatches += diff_results(run['results'], reference[run_key(run)]['results'])
+                run['ok'] = len(mismatches) == 0
+                failed |= not run['ok']
+                runs.append(run)
+
+                label = ' '.join(f'{k}={v}' for k, v in point.items()) or 'defaults'
+                times = ' '.join(f'{run["phases"][name]["time"]:>12.3f}' for name, _ in base.PHASES)
+                check = 'ok' if run['ok'] else 'MISMATCH ' + ','.join(sorted(set(mismatches)))
+                print(f'{label:<40} {argv[1]:>8} {times} {run["max_rss_mib"]:>9.1f}  {check}')
+
+    with open(args.out, 'w') as f:
+        json.dump({'grid': args.grid, 'runs': runs}, f, indent=1)
+    print(f'wrote {len(runs)} runs to {args.out}')
+    if failed:
+        sys.exit('results differ from the reference')
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Time the phases of base.py over a grid of generated workloads')
+    parser.add_argument('--grid', nargs='*', default=[], help='workload parameters to vary, e.g. classes=2,4,8 depth=1,2 (see gen.py, default: a single default workload)')
+    parser.add_argument('--backends', default='dict,sparse', help='comma separated expression backends to run, the first is the reference (default: dict,sparse)')
+    parser.add_argument('--solver', default='gurobi', help='solver backend (default: gurobi)')
+    parser.add_argument('--base-args', default='', help='extra arguments passed on to base.py, e.g. "--early-stop --jobs 2"')
+    parser.add_argument('--reference', metavar='path', default=None, help='earlier benchmark file to check the results against')
+    parser.add_argument('--no-tracemalloc', nargs='?', default=False, const=True, help='only measure time, tracing allocations slows the phases down')
+    parser.add_argument('--out', metavar='path', default='bench.json', help='file to write the measurements to (default: bench.json)')
+    main(parser.parse_args())
@@ -0,0 +1,96 @@
+import os
+import sys
+import time
+import tempfile
+import tracemalloc
+import contextlib
+from defs import *
+from util import *
+from reader import load_graph
+from base import init_model
+
+# memory benchmark for the expression backends (--backend in base.py)
+#
+# builds a chain of n correlation classes {a_i, b_i} and the output facts
+#   p0 <- a0
+#   p_i <- p_{i-1};a_i  (0.9)
+#   p_i <- b_i          (0.8)
+# so that p_i spans i + 1 classes, i.e. 4^(i+1) terms once fully normalized, while most of
+# those terms are 0 because of the conjunctions along the chain
+
+def write_chain(test_dir: str, n: int):
+    with open(test_dir + '/facts.txt', 'w') as f:
+        for i in range(n):
+            f.write(f'a{i} 0.6\nb{i} 0.5\n')
+
+    with open(test_dir + '/edges.txt', 'w') as f:
+        for i in range(n):
+            f.write(f'a{i} b{i} 0.7\n')
+        f.write('p0 a0 1\n')
+        for i in range(1, n):
+            f.write(f'p{i} p{i-1};a{i} 0.9\n')
+            f.write(f'p{i} b{i} 0.8\n')
+
+def run(test_dir: str, backend: str):
+    #keep the pipeline's progress output out of the table
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        graph = load_graph(test_dir, use_cache=False)
+        ctx = Context(init_model())
+        ctx.expression_type = expression_backends[backend]
+
+        read_facts(ctx, graph)
+        read_deps(ctx, graph)
+        build_correlation_classes(ctx)
+        build_constraints(ctx)
+
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        build_expressions(ctx)
+        elapsed = time.perf_counter() - start
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    terms = sum(ctx.expressions[f].num_terms() for f in ctx.output_deps)
+    exprs = {f: str(ctx.expressions[f]) for f in ctx.output_deps}
+    return elapsed, current - before, peak - before, terms, exprs
+
+def parse_expr(s: str) -> dict[frozenset[str], float]:
+    """order-insensitive view of a printed expression, for cross-checking backends"""
+    d = dict[frozenset[str], float]()
+    for t in filter(None, s.split(' + ')):
+        toks = t.split('*')
+        d[frozenset(toks[1:])] = float(toks[0])
+    return d
+
+def same_exprs(e1: dict[str, str], e2: dict[str, str]) -> bool:
+    for f in e1:
+        d1, d2 = parse_expr(e1[f]), parse_expr(e2[f])
+        if d1.keys() != d2.keys() or any(abs(d1[k] - d2[k]) > 1e-9 for k in d1):
+            return False
+    return True
+
+def main(lengths: list[int], backends: list[str]):
+    print(f'{"n":>3} {"backend":>8} {"terms":>10} {"retained KiB":>13} {"peak KiB":>10} {"time s":>8}')
+    for n in lengths:
+        with tempfile.TemporaryDirectory() as test_dir:
+            write_chain(test_dir, n)
+            reference = None
+            for backend in backends:
+                elapsed, retained, peak, terms, exprs = run(test_dir, backend)
+                print(f'{n:>3} {backend:>8} {terms:>10} {retained / 1024:>13.1f} {peak / 1024:>10.1f} {elapsed:>8.3f}')
+                #all backends have to agree on the expressions
+                if reference is None:
+                    reference = exprs
+                elif not same_exprs(reference, exprs):
+                    sys.exit(f'backend {backend} disagrees with {backends[0]} on chain of length {n}')
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Compare memory used by the expression backends on growing chain graphs')
+    parser.add_argument('--lengths', default='1,2,3,4,5,6,7', help='comma separated chain lengths (default: 1,2,3,4,5,6,7)')
+    parser.add_argument('--backends', default='dict,sparse', help='comma separated backends to compare (default: dict,sparse)')
+    args = parser.parse_args()
+
+    main([int(i) for i in args.lengths.split(',')], args.backends.split(','))
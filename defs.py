@@ -1,52 +1,118 @@
 from decimal import Decimal
-from typing import Tuple
-from itertools import product
-from gurobipy import Model, GRB, quicksum, LinExpr, Var
-import copy
+from typing import Tuple, Callable
+from itertools import product, count
+from solver import Problem, Solver, LinSum
+import numpy as np
+import sys
+from store import ExpressionStore
 
 #context class to hold on to everything
 class Context:
-    def __init__(self, m: Model):
+    def __init__(self, problem: Problem):
         self.facts = dict[str, Decimal]()
         self.correlation_classes = set['CorrelationClass']()
         self.fact_to_class = dict[str, 'CorrelationClass']()
         self.fact_deps = dict[str, Tuple[list[str], Decimal]]()
-        self.facts_undirected = dict[str, list[str]]()
+        #side-channel (-1) dependencies, that only put facts in the same correlation class
+        self.side_channels = dict[str, list[list[str]]]()
+        #connected components of the input facts (Definition 4), filled in by read_deps
+        self.fact_components = list[list[str]]()
+        #number of correlation class names handed out, see build_class
+        self.class_count = 0
         self.output_deps = dict[str, list[Tuple[list[str], Decimal]]]()
-        self.model = m
+        #output facts to solve for and the input facts they depend on (see select_queries),
+        #   None means all of them
+        self.queries: list[str] = None
+        self.relevant_facts: set[str] = None
+        #solver independent constraint system, compiled into self.solver by run_optimize
+        self.problem = problem
+        self.solver: Solver = None
         self.aux_count = 0
-        self.expressions = dict[str, Expression]()
+        #product chains already materialised in the problem, keyed on the sym var ids of the factors
+        self.products = dict[tuple[int, ...], int]()
+        #per INPUTDEP row, the two sides of joint == cond_prob * dep before scaling
+        self.dep_sums = dict[str, Tuple[LinSum, LinSum]]()
+        #output facts whose objective is linear (a single correlation class), solved as LPs
+        self.linear_objectives = set[str]()
+        #clique tables of the classes split by decompose_class (the class itself is one of the
+        #   cliques the rules use), and the edges of their junction tree
+        self.clique_tables = dict['CorrelationClass', list['CorrelationClass']]()
+        self.clique_edges = dict['CorrelationClass', list[Tuple['CorrelationClass', 'CorrelationClass']]]()
+        #compiled LPs over single correlation classes, see factorized_bounds and direct_value
+        self.class_solvers = dict['CorrelationClass', Tuple[Solver, dict[int, int]]]()
+        #whether the constraints of a class alone are feasible, see class_feasible
+        self.class_feasible = dict['CorrelationClass', bool]()
+        #expressions of the facts, intermediate ones are dropped after their last use (see build_expressions)
+        self.expressions = ExpressionStore()
+        #which Expression backend to build arithmetic DNFs with, see expression_backends
+        self.expression_type = Expression
         self.results = dict[str, Tuple[Decimal, Decimal]]()
+        #output facts whose interval is only an outer bound (a solve ran out of time), with the
+        #   inner interval of the feasible values found (or None)
+        self.relaxed = dict[str, Tuple[float, float]]()
+        #per query, 'min'/'max' -> status, objective value, runtime and node count of the solve
+        self.solve_stats = dict[str, dict[str, dict]]()
 
     def get_correlation_class_for_fact(self, fact: str) -> 'CorrelationClass':
         return self.fact_to_class[fact]
 
+    def get_queries(self) -> list[str]:
+        return list(self.output_deps) if self.queries is None else self.queries
+
+    def is_relevant(self, fact: str) -> bool:
+        return self.relevant_facts is None or fact in self.relevant_facts
+
 
 #correlation class, contains all facts that belong in the same connected component (Definition 4)
 class CorrelationClass:
-    def __init__(self, name: str, facts: list[str], m: Model):
+    #creation order, used to lay out classes canonically (e.g. tensor axes)
+    _order = count()
+
+    def __init__(self, name: str, facts: list[str], problem: Problem, presolve: Callable[['CorrelationClass'], np.ndarray] = None,
+                 group: str = None):
         self.name = name
+        #the row group its constraints are in, a clique table's are in its class' (see decompose_class)
+        self.group = name if group is None else group
+        self.order = next(CorrelationClass._order)
+        class_table[self.order] = self
         self.facts = facts
         self.fact_indices = dict[str, int]()
-        self.model = m
+        self.problem = problem
+        #one bitmask per world, the i-th fact of the class is bit (n - 1 - i) so that
+        #   formatting a world as a binary string gives the familiar '0101' names
+        self.worlds = self.__gen_worlds()
+        #presolve picks the worlds that can have a non-zero probability, only those get sym vars
+        if presolve is not None:
+            self.worlds = self.worlds[presolve(self)]
         self.sym_vars = self.__gen_sym_vars()
-        self.fact_sums = dict[str, LinExpr]()
+        self.fact_sums = dict[str, LinSum]()
     
     def get_name(self):
         return self.name
+
+    def __reduce__(self):
+        #pickled as a reference into class_table, so expressions can cross process boundaries
+        return (_class_by_order, (self.order,))
     
-    def __gen_sym_vars(self):
+    def __gen_worlds(self) -> np.ndarray:
         # assign an index to each fact
         i = 0
         for f in self.facts:
             self.fact_indices[f] = i
             i += 1
-        
-        #create all bit strings of length # of facts
-        bit_strings = [''.join(map(str, i)) for i in product(range(2), repeat=len(self.facts))]
-        #build symbolic vars for each bit string
-        return [SymVar(b, self) for b in bit_strings]
 
+        #all bitmasks of length # of facts, in the same order as the old bit strings
+        return np.arange(1 << len(self.facts), dtype=np.uint64)
+
+    def __gen_sym_vars(self):
+        #create the vars for the whole class in one go
+        names = [f'{self.name}_{self.world_str(w)}' for w in self.worlds.tolist()]
+        prob_vars = self.problem.add_vars(names)
+        #build symbolic vars for each world, interning them so the i-th world gets id id_base + i
+        self.id_base = len(sym_var_table)
+        sym_vars = [SymVar(self.id_base + i, w, self, prob_vars[i]) for i, w in enumerate(self.worlds.tolist())]
+        sym_var_table.extend(sym_vars)
+        return sym_vars
 
     def __str__(self) -> str:
         return 'correlation class name: ' +\
@@ -57,18 +123,50 @@ class CorrelationClass:
     def get_index_of_fact(self, fact: str):
         return self.fact_indices[fact]
 
+    def get_mask_of_fact(self, fact: str) -> int:
+        return 1 << (len(self.facts) - 1 - self.fact_indices[fact])
+
+    def world_str(self, world: int) -> str:
+        return format(world, f'0{len(self.facts)}b')
+
+    def worlds_with_fact(self, fact: str) -> np.ndarray:
+        """positions (into worlds/sym_vars) of the worlds in which fact is true"""
+        return np.flatnonzero(self.worlds & np.uint64(self.get_mask_of_fact(fact)))
+
 # corresponds to a joint probability variable, Section 5.1
 class SymVar:
-    def __init__(self, name: str, corr_class: CorrelationClass):
-        self.name = name
+    #one of these exists per world, so keep them lean
+    __slots__ = ('id', 'world', 'corr_class', 'var')
+
+    def __init__(self, id: int, world: int, corr_class: CorrelationClass, var: int):
+        self.id = id
+        self.world = world
         self.corr_class = corr_class
-        self.grb_var = self.init_grb_var(self.corr_class.model)
+        #index of the var in the Problem
+        self.var = var
+
+    @property
+    def name(self) -> str:
+        return self.corr_class.world_str(self.world)
+
+    def __reduce__(self):
+        #pickled as a reference into sym_var_table
+        return (_sym_var_by_id, (self.id,))
     
     def __str__(self) -> str:
         return self.corr_class.get_name() + '_' + self.name
-    
-    def init_grb_var(self, m: Model):
-        return m.addVar(vtype=GRB.CONTINUOUS, lb=0, ub=1, name=str(self))
+
+#interned sym vars, indexed by SymVar.id. ids are handed out class by class in creation
+#   order, so sorting the ids of a term also sorts its sym vars by correlation class
+sym_var_table = list[SymVar]()
+#correlation classes by CorrelationClass.order
+class_table = dict[int, CorrelationClass]()
+
+def _sym_var_by_id(id: int) -> SymVar:
+    return sym_var_table[id]
+
+def _class_by_order(order: int) -> CorrelationClass:
+    return class_table[order]
 
 # corresponds to an arithmetic DNF, Definition 7
 class Expression:
@@ -82,7 +180,13 @@ class Expression:
         #   and keeping track of indices
         # why frozenset? because it is hashable (good old set is not)
         self.terms = terms
-        self.corr_classes = set[CorrelationClass]()
+
+    @property
+    def corr_classes(self) -> set[CorrelationClass]:
+        #after normalization all terms share the same classes, so the first one tells
+        if not self.terms:
+            return set[CorrelationClass]()
+        return {i.corr_class for i in next(iter(self.terms))}
 
     #pretty print yay!
     def __str__(self) -> str:
@@ -207,8 +311,8 @@ class Expression:
     def init_for_fact(self, fact: str, corr_class: CorrelationClass) -> None:
         self.init_for_correlation_class(corr_class)
         
-        fact_index = corr_class.get_index_of_fact(fact)
-        set_coeff_1 = [frozenset([i]) for i in corr_class.sym_vars if i.name[fact_index] == '1']
+        sym_vars = corr_class.sym_vars
+        set_coeff_1 = [frozenset([sym_vars[i]]) for i in corr_class.worlds_with_fact(fact)]
         self.terms.update(dict.fromkeys(set_coeff_1, 1))
 
     def multiply_by_const(self, coeff: Decimal):
@@ -219,38 +323,252 @@ class Expression:
             e.terms[i] = v * coeff
         return e
     
-    def to_grb_sum(self, ctx: Context) -> LinExpr:
-        """ converts an Expression to a GRB quicksum"""
-        aux_count = ctx.aux_count
-        m = ctx.model
-        from util import make_grb_var
-
-        #print(f'building grb sum for {self}')
-        #convert expression into a gurobi sum, using aux variables if needed
-        #the process will be to convert each term in the expression into a grb quadratic product
-        #and then quicksum the whole thing
-
-        #the number of correlation classes involved in this expression will tell us if an aux var is required or not
-        #this is not used at the moment. just use aux vars all the time
-        is_aux_required = len(self.get_correlation_classes_used()) > 1
-        #print(is_aux_required)
-
-        grb_sum_terms = list[Var]()
-        for i, v in self.terms.items():
-            grb_vars_in_term = [j.grb_var for j in i if v != 0]
-            if len(grb_vars_in_term) != 0:
-                aux_var = make_grb_var(m, f'aux{aux_count}')
-                m.addConstr(aux_var == float(v) * grb_vars_in_term[0], name=f'c_aux{aux_count}')
-                aux_count += 1
-                acc = aux_var
-                for grb_var in grb_vars_in_term[1:]:
-                    aux_var = make_grb_var(m, f'aux{aux_count}')
-                    m.addConstr(aux_var == acc * grb_var , name=f'c_aux{aux_count}')
-                    aux_count += 1
-                    acc = aux_var
-                
-                grb_sum_terms.append(acc)
-        
+    def iter_terms(self):
+        """yields (sym vars, coefficient) for every non-zero term"""
+        return ((list(i), v) for i, v in self.terms.items() if v != 0)
+
+    def nbytes(self) -> int:
+        """rough memory footprint, extrapolated from the first term"""
+        return terms_nbytes(self.terms)
+
+    def num_terms(self) -> int:
+        """number of coefficients stored"""
+        return len(self.terms)
+
+    def to_lin_sum(self, ctx: Context) -> LinSum:
+        """ converts an Expression to a linear sum over the problem's vars"""
+        return terms_to_lin_sum(ctx, self.iter_terms())
+
+
+# dense backend for arithmetic DNFs: the coefficients live in a numpy tensor with one axis
+#   per correlation class, indexed by the worlds of that class. normalization (Definition 7)
+#   is just broadcasting the missing axes, and rules ADD/MUL in Fig 5 become elementwise ops
+class TensorExpression:
+    def __init__(self, classes: tuple[CorrelationClass, ...] = (), coeffs: np.ndarray = None):
+        #axes are always kept in canonical (creation) order of the classes
+        self.classes = classes
+        self.coeffs = coeffs if coeffs is not None else np.zeros(())
+
+    @property
+    def corr_classes(self) -> set[CorrelationClass]:
+        return set(self.classes)
+
+    def __str__(self) -> str:
+        l = list[str]()
+        for idx in zip(*np.nonzero(self.coeffs)):
+            v = self.coeffs[idx]
+            sym_vars = [str(cl.sym_vars[w]) for cl, w in zip(self.classes, idx)]
+            l.append('%.15g' % v + '*' + '*'.join(sym_vars))
+
+        return ' + '.join(l)
+
+    def normalize(self, other: 'TensorExpression') -> 'TensorExpression':
+        """view of 'self' normalized wrt 'other' (no copy, missing axes are broadcast)"""
+        classes = tuple(sorted(set(self.classes) | set(other.classes), key=lambda cl: cl.order))
+        if classes == self.classes:
+            return self
+
+        #insert a unit axis for every class self doesn't use, then broadcast it out
+        shape = [len(cl.worlds) if cl in self.classes else 1 for cl in classes]
+        full = [len(cl.worlds) for cl in classes]
+        coeffs = np.broadcast_to(self.coeffs.reshape(shape), full)
+        return TensorExpression(classes, coeffs)
 
-        ctx.aux_count = aux_count
-        return quicksum(grb_sum_terms)
\ No newline at end of file
+    def add(self, other: 'TensorExpression') -> 'TensorExpression':
+        a = self.normalize(other)
+        b = other.normalize(self)
+        #rule ADD in Fig 5
+        return TensorExpression(a.classes, a.coeffs + b.coeffs - a.coeffs * b.coeffs)
+
+    def mul(self, other: 'TensorExpression') -> 'TensorExpression':
+        a = self.normalize(other)
+        b = other.normalize(self)
+        #rule MUL in Fig 5
+        return TensorExpression(a.classes, a.coeffs * b.coeffs)
+
+    def get_correlation_classes_used(self):
+        return self.corr_classes
+
+    def init_for_correlation_class(self, corr_class: CorrelationClass) -> None:
+        self.classes = (corr_class,)
+        self.coeffs = np.zeros(len(corr_class.worlds))
+
+    def init_for_fact(self, fact: str, corr_class: CorrelationClass) -> None:
+        self.init_for_correlation_class(corr_class)
+        self.coeffs[corr_class.worlds_with_fact(fact)] = 1
+
+    def multiply_by_const(self, coeff: Decimal):
+        return TensorExpression(self.classes, self.coeffs * float(coeff))
+
+    def iter_terms(self):
+        """yields (sym vars, coefficient) for every non-zero term"""
+        idxs = zip(*np.nonzero(self.coeffs))
+        return (([cl.sym_vars[w] for cl, w in zip(self.classes, idx)], self.coeffs[idx]) for idx in idxs)
+
+    def nbytes(self) -> int:
+        return self.coeffs.nbytes
+
+    def num_terms(self) -> int:
+        """number of coefficients stored"""
+        return self.coeffs.size
+
+    def to_lin_sum(self, ctx: Context) -> LinSum:
+        """ converts a TensorExpression to a linear sum over the problem's vars"""
+        return terms_to_lin_sum(ctx, self.iter_terms())
+
+
+# sparse backend for arithmetic DNFs: sym vars are interned as integer ids (SymVar.id) and
+#   a term is the sorted tuple of its ids, one per correlation class in self.classes.
+#   only non-zero terms are ever stored, so MUL joins the two operands on the classes they
+#   share instead of walking the full normalized cross product
+class SparseExpression:
+    __slots__ = ('classes', 'terms')
+
+    def __init__(self, classes: tuple[CorrelationClass, ...] = (), terms: dict[tuple[int, ...], Decimal] = None):
+        #classes are kept in canonical (creation) order, which is also the order of the ids in a term
+        self.classes = classes
+        self.terms = terms if terms is not None else dict[tuple[int, ...], Decimal]()
+
+    @property
+    def corr_classes(self) -> set[CorrelationClass]:
+        return set(self.classes)
+
+    def __str__(self) -> str:
+        l = list[str]()
+        for (k, v) in self.terms.items():
+            sym_vars = [str(sym_var_table[i]) for i in k]
+            l.append(str(v) + '*' + '*'.join(sym_vars))
+
+        return ' + '.join(l)
+
+    def __union_classes(self, other: 'SparseExpression'):
+        """classes of the normalized result, and the positions of self's/other's classes in it"""
+        classes = tuple(sorted(set(self.classes) | set(other.classes), key=lambda cl: cl.order))
+        self_pos = [classes.index(cl) for cl in self.classes]
+        other_pos = [classes.index(cl) for cl in other.classes]
+        return classes, self_pos, other_pos
+
+    def add(self, other: 'SparseExpression') -> 'SparseExpression':
+        classes, self_pos, other_pos = self.__union_classes(other)
+        t = dict[tuple[int, ...], Decimal]()
+
+        #every world of the normalized expression where self is non-zero, the classes missing
+        #   from self are filled in with all of their sym vars (Definition 7)
+        missing = [range(cl.id_base, cl.id_base + len(cl.sym_vars)) for cl in classes if cl not in self.classes]
+        for (k, c1) in self.terms.items():
+            for ext in product(*missing):
+                key = tuple(sorted(k + ext))
+                c2 = other.terms.get(tuple(key[i] for i in other_pos), 0)
+                #rule ADD in Fig 5
+                c = c1 + c2 - c1 * c2
+                if c != 0:
+                    t[key] = c
+
+        #worlds where only other is non-zero, so the sum is just other's coefficient
+        missing = [range(cl.id_base, cl.id_base + len(cl.sym_vars)) for cl in classes if cl not in other.classes]
+        for (k, c2) in other.terms.items():
+            for ext in product(*missing):
+                key = tuple(sorted(k + ext))
+                if tuple(key[i] for i in self_pos) not in self.terms:
+                    t[key] = c2
+
+        return SparseExpression(classes, t)
+
+    def mul(self, other: 'SparseExpression') -> 'SparseExpression':
+        classes, self_pos, other_pos = self.__union_classes(other)
+        shared = set(self.classes) & set(other.classes)
+        self_shared = [i for i, cl in enumerate(self.classes) if cl in shared]
+        other_shared = [i for i, cl in enumerate(other.classes) if cl in shared]
+
+        #index other's terms by their sym vars in the shared classes
+        index = dict[tuple[int, ...], list[tuple[tuple[int, ...], Decimal]]]()
+        for (k, v) in other.terms.items():
+            index.setdefault(tuple(k[i] for i in other_shared), []).append((k, v))
+
+        #only terms that agree on the shared classes survive rule MUL in Fig 5
+        t = dict[tuple[int, ...], Decimal]()
+        for (k1, c1) in self.terms.items():
+            for (k2, c2) in index.get(tuple(k1[i] for i in self_shared), ()):
+                c = c1 * c2
+                if c != 0:
+                    t[tuple(sorted(set(k1).union(k2)))] = c
+
+        return SparseExpression(classes, t)
+
+    def get_correlation_classes_used(self):
+        return self.corr_classes
+
+    def init_for_correlation_class(self, corr_class: CorrelationClass) -> None:
+        #all coefficients are 0, so there is nothing to store
+        self.classes = (corr_class,)
+        self.terms = dict[tuple[int, ...], Decimal]()
+
+    def init_for_fact(self, fact: str, corr_class: CorrelationClass) -> None:
+        self.init_for_correlation_class(corr_class)
+        self.terms = {(corr_class.id_base + int(i),): 1 for i in corr_class.worlds_with_fact(fact)}
+
+    def multiply_by_const(self, coeff: Decimal):
+        return SparseExpression(self.classes, {k: v * coeff for k, v in self.terms.items() if v * coeff != 0})
+
+    def iter_terms(self):
+        """yields (sym vars, coefficient) for every non-zero term"""
+        return (([sym_var_table[i] for i in k], v) for k, v in self.terms.items())
+
+    def nbytes(self) -> int:
+        """rough memory footprint, extrapolated from the first term"""
+        return terms_nbytes(self.terms)
+
+    def num_terms(self) -> int:
+        """number of coefficients stored"""
+        return len(self.terms)
+
+    def to_lin_sum(self, ctx: Context) -> LinSum:
+        """ converts a SparseExpression to a linear sum over the problem's vars"""
+        return terms_to_lin_sum(ctx, self.iter_terms())
+
+
+#selectable from base.py (--backend)
+expression_backends = {
+    'dict': Expression,
+    'tensor': TensorExpression,
+    'sparse': SparseExpression,
+}
+
+
+def terms_nbytes(terms: dict) -> int:
+    """size of a dict of terms, assuming all of its keys and values are about the size of the first ones"""
+    if len(terms) == 0:
+        return sys.getsizeof(terms)
+    k, v = next(iter(terms.items()))
+    return sys.getsizeof(terms) + len(terms) * (sys.getsizeof(k) + sys.getsizeof(v))
+
+def get_product_var(ctx: Context, sym_vars: list[SymVar]) -> int:
+    """returns a var equal to the product of sym_vars (in canonical, i.e. id, order)
+
+    products are kept in a problem-wide cache keyed on the ids of their factors, so that every
+    prefix of a product chain is materialised once in the problem and shared by all sums using it"""
+    key = tuple(sv.id for sv in sym_vars)
+    #a single sym var is its own product
+    acc = sym_vars[0].var
+    for i in range(2, len(key) + 1):
+        prefix = key[:i]
+        if prefix in ctx.products:
+            acc = ctx.products[prefix]
+        else:
+            acc = ctx.problem.add_product(acc, sym_vars[i - 1].var, f'aux{ctx.aux_count}')
+            ctx.aux_count += 1
+            ctx.products[prefix] = acc
+
+    return acc
+
+def terms_to_lin_sum(ctx: Context, terms) -> LinSum:
+    """ converts (sym vars, coefficient) terms to a linear sum over the problem's vars"""
+    #convert each term in the expression into a (cached) product of its sym vars,
+    #and then sum the products up, applying the constant coefficients at the sum
+    lin_sum = LinSum()
+    for i, v in terms:
+        if v != 0:
+            var = get_product_var(ctx, sorted(i, key=lambda sv: sv.id))
+            lin_sum[var] = lin_sum.get(var, 0.0) + float(v)
+
+    return lin_sum
@@ -0,0 +1,108 @@
+import os
+import random
+
+# synthetic workload generator, writes a facts.txt/edges.txt pair in the format base.py reads
+#
+# the input facts come in correlation classes of class_size facts each. within a class the
+#   facts are related along a random tree, each edge being either a conditional probability
+#   (kept within the Frechet bounds of the two marginals, so the system stays feasible) or a
+#   side-channel -1 edge that only puts the facts in the same class. the output facts are laid
+#   out in depth levels of outputs facts each: every one of them has fan_in rules, whose bodies
+#   pick (with probability multi_body) body_size events instead of one, from the input facts
+#   and the output facts of lower levels
+
+class Workload:
+    def __init__(self, classes: int = 4, class_size: int = 2, outputs: int = 4, depth: int = 2,
+                 fan_in: int = 2, multi_body: float = 0.5, body_size: int = 2, side_channel: float = 0.0,
+                 seed: int = 0):
+        self.classes = classes
+        self.class_size = class_size
+        self.outputs = outputs
+        self.depth = depth
+        self.fan_in = fan_in
+        self.multi_body = multi_body
+        self.body_size = body_size
+        self.side_channel = side_channel
+        self.seed = seed
+
+    def params(self) -> dict:
+        return dict(vars(self))
+
+def round_prob(p: float) -> float:
+    return round(p, 3)
+
+def gen_workload(w: Workload) -> tuple[list[str], list[str]]:
+    """the lines of facts.txt and edges.txt for w"""
+    rng = random.Random(w.seed)
+    fact_lines, edge_lines = list[str](), list[str]()
+
+    facts = list[str]()
+    marginals = dict[str, float]()
+    for c in range(w.classes):
+        members = list[str]()
+        for i in range(w.class_size):
+            f = f'e{c}_{i}'
+            p = round_prob(rng.uniform(0.1, 0.9))
+            fact_lines.append(f'{f} {p}')
+            if members:
+                #tree edge to an earlier fact of the class
+                parent = rng.choice(members)
+                if rng.random() < w.side_channel:
+                    edge_lines.append(f'{f} {parent} -1')
+                else:
+                    edge_lines.append(f'{f} {parent} {cond_prob(rng, p, marginals[parent])}')
+            members.append(f)
+            marginals[f] = p
+        facts.extend(members)
+
+    lower = list[str]()
+    for l in range(w.depth):
+        level = [f'p{l}_{j}' for j in range(w.outputs)]
+        for head in level:
+            for _ in range(w.fan_in):
+                k = w.body_size if rng.random() < w.multi_body else 1
+                #every rule above the first level uses at least one output fact of a lower level
+                body = rng.sample(facts, min(k, len(facts)))
+                if lower:
+                    body[0] = rng.choice(lower)
+                body = list(dict.fromkeys(body))
+                edge_lines.append(f'{head} {";".join(body)} {round_prob(rng.uniform(0.5, 1))}')
+        lower.extend(level)
+
+    return fact_lines, edge_lines
+
+def cond_prob(rng: random.Random, p_head: float, p_body: float) -> float:
+    """P(head | body), such that the joint P(head, body) is within the Frechet bounds"""
+    lo = max(0.0, p_head + p_body - 1) / p_body
+    hi = min(p_head, p_body) / p_body
+    #stay clear of the bounds, so rounding can't make the system infeasible
+    return round_prob(rng.uniform(lo + (hi - lo) * 0.1, hi - (hi - lo) * 0.1))
+
+def write_workload(w: Workload, test_dir: str):
+    os.makedirs(test_dir, exist_ok=True)
+    fact_lines, edge_lines = gen_workload(w)
+    with open(os.path.join(test_dir, 'facts.txt'), 'w') as f:
+        f.write('\n'.join(fact_lines) + '\n')
+    with open(os.path.join(test_dir, 'edges.txt'), 'w') as f:
+        f.write('\n'.join(edge_lines) + '\n')
+
+if __name__ == "__main__":
+    import argparse
+
+    defaults = Workload()
+    parser = argparse.ArgumentParser(description='Generate a synthetic facts.txt/edges.txt workload')
+    parser.add_argument('--testdir', metavar='path', required=True, help='directory to write the graph artifacts to')
+    parser.add_argument('--classes', type=int, default=defaults.classes, help=f'number of correlation classes (default: {defaults.classes})')
+    parser.add_argument('--class-size', type=int, default=defaults.class_size, help=f'input facts per correlation class (default: {defaults.class_size})')
+    parser.add_argument('--outputs', type=int, default=defaults.outputs, help=f'output facts per level (default: {defaults.outputs})')
+    parser.add_argument('--depth', type=int, default=defaults.depth, help=f'levels of output facts (default: {defaults.depth})')
+    parser.add_argument('--fan-in', type=int, default=defaults.fan_in, help=f'rules per output fact (default: {defaults.fan_in})')
+    parser.add_argument('--multi-body', type=float, default=defaults.multi_body, help=f'probability of a rule having a conjunctive body (default: {defaults.multi_body})')
+    parser.add_argument('--body-size', type=int, default=defaults.body_size, help=f'events in a conjunctive body (default: {defaults.body_size})')
+    parser.add_argument('--side-channel', type=float, default=defaults.side_channel, help=f'probability of a class edge being a side-channel -1 edge (default: {defaults.side_channel})')
+    parser.add_argument('--seed', type=int, default=defaults.seed, help=f'random seed (default: {defaults.seed})')
+    args = parser.parse_args()
+
+    w = Workload(args.classes, args.class_size, args.outputs, args.depth, args.fan_in,
+                 args.multi_body, args.body_size, args.side_channel, args.seed)
+    write_workload(w, args.testdir)
@@ -0,0 +1,151 @@
+import os
+import io
+import json
+import time
+import resource
+from contextlib import contextmanager
+from defs import Context
+
+# built-in instrumentation for base.py
+#
+# records the wall time and memory of every phase of the pipeline, the size of the built
+#   model and the solve statistics of every query, and writes them as json (stats.json next
+#   to results.txt). the expression builder can additionally be run under cProfile or
+#   tracemalloc (--profile-exprs)
+
+#number of entries kept from the cProfile/tracemalloc reports
+TOP_N = 25
+
+def rss_mib() -> float:
+    """current resident set size of this process"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError):
+        return None
+
+def reset_peak_rss() -> bool:
+    """reset the VmHWM high-water mark of this process to its current rss (linux 4.0+), False
+    where that isn't possible"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def peak_rss_mib() -> float:
+    """VmHWM of this process, the peak rss since the last reset_peak_rss"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+def max_rss_mib(who: int = resource.RUSAGE_SELF) -> float:
+    """peak resident set size so far, ru_maxrss is in KiB on linux"""
+    return resource.getrusage(who).ru_maxrss / 1024
+
+class Instrumentation:
+    def __init__(self, profile_exprs: str = None, out_dir: str = None):
+        #None, 'cprofile' or 'tracemalloc', run around the expressions phase
+        self.profile_exprs = profile_exprs
+        self.out_dir = out_dir
+        self.phases = dict[str, dict]()
+        self.expression_profile: dict = None
+        #peak rss of the process over the phases so far, resetting VmHWM resets ru_maxrss too
+        self.max_rss_mib = 0.0
+
+    @contextmanager
+    def phase(self, name: str):
+        #the peak of only this phase where the high-water mark can be reset
+        per_phase = reset_peak_rss()
+        start = time.perf_counter()
+        if name == 'expressions' and self.profile_exprs is not None:
+            with self.__profile():
+                yield
+        else:
+            yield
+        peak = peak_rss_mib() if per_phase else None
+        self.max_rss_mib = max(self.max_rss_mib, max_rss_mib(), peak or 0.0)
+        self.phases[name] = {
+            'time': time.perf_counter() - start,
+            'rss_mib': rss_mib(),
+            #'phase': peak_rss_mib is the peak during this phase, 'process': it is the cumulative
+            #ru_maxrss, the peak of this phase or of any earlier one
+            'peak_rss_scope': 'phase' if peak is not None else 'process',
+            'peak_rss_mib': peak if peak is not None else max_rss_mib(),
+            #the peak of this phase or of any earlier one
+            'process_max_rss_mib': self.max_rss_mib,
+            #the same for the worker processes (--build-jobs, --jobs) that have finished so far
+            'children_process_max_rss_mib': max_rss_mib(resource.RUSAGE_CHILDREN),
+        }
+
+    @contextmanager
+    def __profile(self):
+        if self.profile_exprs == 'cprofile':
+            import cProfile
+            import pstats
+            prof = cProfile.Profile()
+            prof.enable()
+            yield
+            prof.disable()
+            path = os.path.join(self.out_dir, 'expressions.prof')
+            prof.dump_stats(path)
+            report = io.StringIO()
+            pstats.Stats(prof, stream=report).sort_stats('cumulative').print_stats(TOP_N)
+            self.expression_profile = {'cprofile': path, 'top': report.getvalue().splitlines()}
+        else:
+            import tracemalloc
+            tracemalloc.start()
+            yield
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            self.expression_profile = {
+                'traced_mib': current / 2**20,
+                'traced_peak_mib': peak / 2**20,
+                'top': [str(s) for s in snapshot.statistics('lineno')[:TOP_N]],
+            }
+
+    def model_stats(self, ctx: Context) -> dict:
+        problem = ctx.problem
+        return {
+            'correlation_classes': len(ctx.correlation_classes),
+            'sym_vars': sum(len(t.sym_vars) for cl in ctx.correlation_classes for t in [cl] + ctx.clique_tables.get(cl, [])),
+            'clique_tables': sum(len(t) for t in ctx.clique_tables.values()),
+            'aux_vars': ctx.aux_count,
+            'vars': problem.num_vars(),
+            'linear_constraints': len(problem.row_names),
+            'bilinear_constraints': len(problem.prod_names),
+            'linear_objectives': len(ctx.linear_objectives),
+            'queries': len(ctx.get_queries()),
+        }
+
+    def query_stats(self, ctx: Context) -> dict:
+        stats = dict[str, dict]()
+        for out in ctx.get_queries():
+            e = ctx.expressions[out] if out in ctx.expressions else None
+            stats[out] = {
+                'terms': e.num_terms() if e is not None else None,
+                'classes': len(e.get_correlation_classes_used()) if e is not None else None,
+                'linear': out in ctx.linear_objectives,
+                'relaxed': out in ctx.relaxed,
+                'solves': ctx.solve_stats.get(out, {}),
+            }
+        return stats
+
+    def write(self, ctx: Context, path: str):
+        stats = {
+            'phases': self.phases,
+            'total_time': sum(p['time'] for p in self.phases.values()),
+            'model': self.model_stats(ctx),
+            'queries': self.query_stats(ctx),
+        }
+        if self.expression_profile is not None:
+            stats['expression_profile'] = self.expression_profile
+        with open(path, 'w') as f:
+            json.dump(stats, f, indent=1)
@@ -0,0 +1,218 @@
+import os
+import sys
+import json
+from array import array
+import numpy as np
+
+# streaming reader for the graph artifacts (facts.txt, edges.txt)
+#
+# names are interned to integer ids and probabilities kept in numeric arrays, and the
+#   correlation classes (connected components of the input facts, Definition 4) are found
+#   with a union-find over the fact ids while the edges stream by. the parsed
+#   arrays are cached as .npy files in a .parsed/ directory next to the inputs, keyed on the
+#   size and mtime of the inputs, and memory mapped on later runs instead of re-parsing
+
+#bytes read per chunk
+CHUNK_SIZE = 1 << 20
+CACHE_DIR = '.parsed'
+CACHE_VERSION = 2
+ARRAYS = ('fact_ids', 'fact_probs', 'fact_class', 'rule_heads', 'rule_probs', 'body_offsets', 'body_ids')
+
+class ParsedGraph:
+    def __init__(self):
+        #interned names, the id of a name is its index
+        self.names = list[str]()
+        #input facts and their marginal probabilities
+        self.fact_ids: np.ndarray = None
+        self.fact_probs: np.ndarray = None
+        #correlation class of each input fact, classes numbered in order of their first fact
+        self.fact_class: np.ndarray = None
+        #rules head <- body (prob), the body of rule r is body_ids[body_offsets[r]:body_offsets[r + 1]]
+        self.rule_heads: np.ndarray = None
+        self.rule_probs: np.ndarray = None
+        self.body_offsets: np.ndarray = None
+        self.body_ids: np.ndarray = None
+
+    def num_rules(self) -> int:
+        return len(self.rule_heads)
+
+    def rule_body(self, r: int) -> list[str]:
+        return [self.names[i] for i in self.body_ids[self.body_offsets[r]:self.body_offsets[r + 1]].tolist()]
+
+def stream_lines(path: str):
+    """yields (line number, tokens) for every non-empty line of a file, read in chunks"""
+    with open(path) as f:
+        lineno = 0
+        while True:
+            chunk = f.readlines(CHUNK_SIZE)
+            if not chunk:
+                break
+            for line in chunk:
+                lineno += 1
+                line = line.strip()
+                if line:
+                    yield lineno, line.split(' ')
+
+def parse_prob(tok: str, path: str, lineno: int) -> float:
+    try:
+        return float(tok)
+    except ValueError:
+        sys.exit(f'{path}:{lineno}: malformed probability {tok!r}')
+
+def parse_graph(test_dir: str) -> ParsedGraph:
+    g = ParsedGraph()
+    ids = dict[str, int]()
+
+    def intern(name: str) -> int:
+        i = ids.get(name)
+        if i is None:
+            i = ids[name] = len(g.names)
+            g.names.append(name)
+        return i
+
+    facts_path = os.path.join(test_dir, 'facts.txt')
+    fact_ids, fact_probs = array('i'), array('d')
+    for lineno, toks in stream_lines(facts_path):
+        if len(toks) != 2:
+            sys.exit(f'{facts_path}:{lineno}: unexpected number of tokens in facts.txt')
+        fact_ids.append(intern(toks[0]))
+        fact_probs.append(parse_prob(toks[1], facts_path, lineno))
+    #facts are interned first, so the input facts are exactly the ids below num_facts
+    num_facts = len(g.names)
+
+    #union-find over the fact ids, with path halving and union by size
+    parent = array('i', range(num_facts))
+    size = array('i', [1]) * num_facts
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(i: int, j: int):
+        i, j = find(i), find(j)
+        if i != j:
+            if size[i] < size[j]:
+                i, j = j, i
+            parent[j] = i
+            size[i] += size[j]
+
+    edges_path = os.path.join(test_dir, 'edges.txt')
+    rule_heads, rule_probs = array('i'), array('d')
+    body_offsets, body_ids = array('q', [0]), array('i')
+    for lineno, toks in stream_lines(edges_path):
+        if len(toks) != 3:
+            sys.exit(f'{edges_path}:{lineno}: unexpected number of tokens in edges.txt')
+        head = intern(toks[0])
+        body = [intern(d) for d in toks[1].split(';')]
+        if head < num_facts:
+            for d, name in zip(body, toks[1].split(';')):
+                #sanity check, a dependency of an input fact can only be on input facts
+                if d >= num_facts:
+                    sys.exit(f'{edges_path}:{lineno}: source {toks[0]} dep {name} not a fact')
+                #related facts end up in the same correlation class (side-channel -1 edges included)
+                union(head, d)
+
+        rule_heads.append(head)
+        rule_probs.append(parse_prob(toks[2], edges_path, lineno))
+        body_ids.extend(body)
+        body_offsets.append(len(body_ids))
+
+    #number the classes in order of their first fact
+    labels = dict[int, int]()
+    fact_class = array('i', (labels.setdefault(find(f), len(labels)) for f in fact_ids))
+
+    g.fact_ids = np.frombuffer(fact_ids, dtype=np.int32)
+    g.fact_class = np.frombuffer(fact_class, dtype=np.int32)
+    g.fact_probs = np.frombuffer(fact_probs, dtype=np.float64)
+    g.rule_heads = np.frombuffer(rule_heads, dtype=np.int32)
+    g.rule_probs = np.frombuffer(rule_probs, dtype=np.float64)
+    g.body_offsets = np.frombuffer(body_offsets, dtype=np.int64)
+    g.body_ids = np.frombuffer(body_ids, dtype=np.int32)
+    return g
+
+def parse_scenario(path: str) -> tuple[dict[str, float], dict[tuple[str, tuple[str, ...]], float]]:
+    """a scenario file, in the line formats of facts.txt (name prob, a new marginal) and
+    edges.txt (head body prob, a new probability for an existing rule)"""
+    facts = dict[str, float]()
+    rules = dict[tuple[str, tuple[str, ...]], float]()
+    for lineno, toks in stream_lines(path):
+        if len(toks) == 2:
+            facts[toks[0]] = parse_prob(toks[1], path, lineno)
+        elif len(toks) == 3:
+            rules[(toks[0], tuple(toks[1].split(';')))] = parse_prob(toks[2], path, lineno)
+        else:
+            sys.exit(f'{path}:{lineno}: unexpected number of tokens in scenario')
+    return facts, rules
+
+def parse_delta(path: str) -> tuple[dict[str, float], set[str], list[tuple[str, list[str], float]], list[tuple[str, list[str]]]]:
+    """a delta file, lines of facts.txt and edges.txt prefixed with + (added) or - (removed, without
+    the probability): '+ e99 0.3', '- e12', '+ p17 e57;p15 0.8', '- p17 e57;p15'. returns the
+    added facts, removed facts, added rules and removed rules"""
+    add_facts, remove_facts = dict[str, float](), set[str]()
+    add_rules, remove_rules = list[tuple[str, list[str], float]](), list[tuple[str, list[str]]]()
+    for lineno, toks in stream_lines(path):
+        op, toks = toks[0], toks[1:]
+        if op == '+' and len(toks) == 2:
+            add_facts[toks[0]] = parse_prob(toks[1], path, lineno)
+        elif op == '-' and len(toks) == 1:
+            remove_facts.add(toks[0])
+        elif op == '+' and len(toks) == 3:
+            add_rules.append((toks[0], toks[1].split(';'), parse_prob(toks[2], path, lineno)))
+        elif op == '-' and len(toks) == 2:
+            remove_rules.append((toks[0], toks[1].split(';')))
+        else:
+            sys.exit(f'{path}:{lineno}: expected + or - followed by a fact or rule')
+    return add_facts, remove_facts, add_rules, remove_rules
+
+def cache_key(test_dir: str) -> dict:
+    """identifies the inputs a cache was built from"""
+    key = {'version': CACHE_VERSION}
+    for name in ('facts.txt', 'edges.txt'):
+        st = os.stat(os.path.join(test_dir, name))
+        key[name] = [st.st_size, st.st_mtime_ns]
+    return key
+
+def load_cache(test_dir: str) -> ParsedGraph:
+    """the cached graph of test_dir, or None if there is none or it is stale"""
+    cache_dir = os.path.join(test_dir, CACHE_DIR)
+    try:
+        with open(os.path.join(cache_dir, 'key.json')) as f:
+            if json.load(f) != cache_key(test_dir):
+                return None
+        g = ParsedGraph()
+        with open(os.path.join(cache_dir, 'names.txt')) as f:
+            g.names = f.read().split('\n')
+        for a in ARRAYS:
+            setattr(g, a, np.load(os.path.join(cache_dir, f'{a}.npy'), mmap_mode='r'))
+        return g
+    except (OSError, ValueError):
+        return None
+
+def write_cache(test_dir: str, g: ParsedGraph):
+    cache_dir = os.path.join(test_dir, CACHE_DIR)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        for a in ARRAYS:
+            np.save(os.path.join(cache_dir, f'{a}.npy'), getattr(g, a))
+        with open(os.path.join(cache_dir, 'names.txt'), 'w') as f:
+            f.write('\n'.join(g.names))
+        #written last, so a half written cache is never picked up
+        with open(os.path.join(cache_dir, 'key.json'), 'w') as f:
+            json.dump(cache_key(test_dir), f)
+    except OSError as e:
+        print(f'could not cache the parsed graph in {cache_dir}: {e}')
+
+def load_graph(test_dir: str, use_cache: bool = True) -> ParsedGraph:
+    """parses the graph artifacts in test_dir, going through the binary cache if allowed"""
+    if use_cache:
+        g = load_cache(test_dir)
+        if g is not None:
+            print(f'loaded parsed graph from {os.path.join(test_dir, CACHE_DIR)}')
+            return g
+
+    g = parse_graph(test_dir)
+    if use_cache:
+        write_cache(test_dir, g)
+    return g
@@ -0,0 +1,157 @@
+import os
+import sys
+import json
+import time
+import signal
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+import base
+from defs import Context
+from solver import solver_backends, MINIMIZE, MAXIMIZE
+
+# query server: builds the model of a test directory once (the phases of base.py up to the
+#   objectives) and answers json-lines requests against it, over stdin/stdout or a unix socket
+#
+#   request:  {"id": 1, "queries": ["p17", "p16"]}
+#   response: {"id": 1, "results": {"p17": [0.42, 0.53], "p16": [0.37, 0.58]}, "latency_ms": 3.1}
+#             {"id": 1, "error": "..."}
+#
+# requests are solved on a bounded pool of worker threads, each with its own compiled copy of
+#   the model (and gurobi env), and answered intervals are cached since the model never changes
+
+class QueryServer:
+    def __init__(self, ctx: Context, solver_name: str, workers: int):
+        self.ctx = ctx
+        self.solver_name = solver_name
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        #the solver compiled by each worker thread
+        self.local = threading.local()
+        self.cache = dict[str, tuple[float, float]]()
+        self.cache_lock = threading.Lock()
+        self.queries = set(ctx.get_queries())
+
+    def get_solver(self):
+        solver = getattr(self.local, 'solver', None)
+        if solver is None:
+            solver = self.local.solver = solver_backends[self.solver_name](self.ctx.problem)
+        return solver
+
+    def solve(self, out: str) -> tuple[float, float]:
+        """the interval of an output fact, -1 for a bound that couldn't be found"""
+        with self.cache_lock:
+            if out in self.cache:
+                return self.cache[out]
+        solver = self.get_solver()
+        objective = self.ctx.problem.get_var_by_name(f'obj_{out}')
+        linear = out in self.ctx.linear_objectives
+        bounds = list[float]()
+        for sense in (MINIMIZE, MAXIMIZE):
+            r = solver.solve(objective, sense, linear)
+            bounds.append(r.obj_val if r.optimal else -1)
+        with self.cache_lock:
+            self.cache[out] = (bounds[0], bounds[1])
+        return self.cache[out]
+
+    def handle(self, line: str, received: float) -> dict:
+        """answers one request line, runs on a worker thread"""
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            return {'error': f'malformed request: {e}'}
+        id = request.get('id') if isinstance(request, dict) else None
+        queries = request.get('queries') if isinstance(request, dict) else None
+        if not isinstance(queries, list) or len(queries) == 0:
+            return {'id': id, 'error': 'request needs a non-empty list of queries'}
+        unknown = [q for q in queries if q not in self.queries]
+        if unknown:
+            return {'id': id, 'error': f'not a built output fact: {", ".join(map(str, unknown))}'}
+
+        results = {out: self.solve(out) for out in queries}
+        return {'id': id, 'results': results, 'latency_ms': (time.perf_counter() - received) * 1000}
+
+    def submit(self, line: str, respond):
+        """queues a request on the pool, respond is called with the response line"""
+        received = time.perf_counter()
+        future = self.pool.submit(self.handle, line, received)
+
+        def done(f):
+            e = f.exception()
+            respond(json.dumps(f.result() if e is None else {'error': f'{type(e).__name__}: {e}'}))
+        future.add_done_callback(done)
+
+    def serve_stdio(self):
+        out_lock = threading.Lock()
+
+        def respond(response: str):
+            with out_lock:
+                sys.stdout.write(response + '\n')
+                sys.stdout.flush()
+
+        for line in sys.stdin:
+            if line.strip():
+                self.submit(line, respond)
+        self.pool.shutdown(wait=True)
+
+    def serve_socket(self, path: str):
+        import socketserver
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                write_lock = threading.Lock()
+                pending = list()
+
+                def respond(response: str):
+                    with write_lock:
+                        self.wfile.write((response + '\n').encode())
+                        self.wfile.flush()
+
+                for line in self.rfile:
+                    line = line.decode()
+                    if line.strip():
+                        done = threading.Event()
+                        pending.append(done)
+                        server.submit(line, lambda r, done=done: (respond(r), done.set()))
+                #answer everything the client sent before the connection goes away
+                for done in pending:
+                    done.wait()
+
+        if os.path.exists(path):
+            os.remove(path)
+        #exit through the finally below on a plain kill too, so the socket file goes away
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+        with socketserver.ThreadingUnixStreamServer(path, Handler) as s:
+            print(f'serving on {path}', file=sys.stderr)
+            try:
+                s.serve_forever()
+            finally:
+                os.remove(path)
+
+def load(args) -> Context:
+    """runs the phases of base.py that build the model, up to (not including) the optimization"""
+    setattr(base.gb, 'args', args)
+    ctx = base.new_context()
+    names = [name for name, _ in base.PHASES]
+    for _, phase in base.PHASES[:names.index('optimize')]:
+        phase(ctx)
+    return ctx
+
+if __name__ == "__main__":
+    parser = base.make_parser('Serve interval queries on a model built once', outdir=False)
+    parser.add_argument('--socket', metavar='path', default=None, help='unix socket to serve on (default: json lines on stdin/stdout)')
+    parser.add_argument('--workers', type=int, default=4, help='requests solved at once (default: 4)')
+    args = parser.parse_args()
+    args.outdir = None
+
+    start = time.perf_counter()
+    #stdout is the response channel, keep the build output off it
+    with contextlib.redirect_stdout(sys.stderr):
+        ctx = load(args)
+    print(f'model built in {time.perf_counter() - start} seconds, {len(ctx.get_queries())} queries', file=sys.stderr)
+
+    server = QueryServer(ctx, args.solver, args.workers)
+    if args.socket is not None:
+        server.serve_socket(args.socket)
+    else:
+        server.serve_stdio()
@@ -0,0 +1,481 @@
+import time
+import threading
+from abc import ABC, abstractmethod
+import numpy as np
+
+# solver abstraction layer
+#
+# the constraint system of Fig 6 is first described solver-independently as a Problem
+#   (vars, linear equality rows and bilinear aux definitions z == x * y), and then handed
+#   to one of the backends in solver_backends to be solved for any number of objectives
+
+MINIMIZE = 1
+MAXIMIZE = -1
+
+#a linear sum, var index -> coefficient
+LinSum = dict[int, float]
+
+def lin_sub(a: LinSum, b: LinSum) -> LinSum:
+    """a - b"""
+    d = dict(a)
+    for i, v in b.items():
+        d[i] = d.get(i, 0.0) - v
+    return d
+
+class Problem:
+    def __init__(self, name: str):
+        self.name = name
+        #vars, referred to by their index
+        self.var_names = list[str]()
+        self.var_index = dict[str, int]()
+        self.lb = list[float]()
+        self.ub = list[float]()
+        #linear rows, sum(row_coeffs[r][k] * row_vars[r][k]) == rhs[r]
+        self.row_names = list[str]()
+        self.row_index = dict[str, int]()
+        self.row_vars = list[list[int]]()
+        self.row_coeffs = list[list[float]]()
+        self.rhs = list[float]()
+        #rows by group (the correlation class or objective they belong to), see restrict
+        self.group_rows = dict[str, list[int]]()
+        #bilinear aux definitions, prod_z[p] == prod_x[p] * prod_y[p]
+        self.prod_names = list[str]()
+        self.prod_z = list[int]()
+        self.prod_x = list[int]()
+        self.prod_y = list[int]()
+        #aux var -> index of its definition
+        self.var_product = dict[int, int]()
+        #rows emptied by remove_group, dropped by compact
+        self.removed_rows = set[int]()
+
+    def num_vars(self) -> int:
+        return len(self.var_names)
+
+    def add_var(self, name: str, lb: float = 0, ub: float = 1) -> int:
+        self.var_index[name] = len(self.var_names)
+        self.var_names.append(name)
+        self.lb.append(lb)
+        self.ub.append(ub)
+        return self.var_index[name]
+
+    def add_vars(self, names: list[str], lb: float = 0, ub: float = 1) -> range:
+        """adds a block of vars at once, returns their (contiguous) indices"""
+        start = len(self.var_names)
+        self.var_index.update(zip(names, range(start, start + len(names))))
+        self.var_names.extend(names)
+        self.lb.extend([lb] * len(names))
+        self.ub.extend([ub] * len(names))
+        return range(start, start + len(names))
+
+    def get_var_by_name(self, name: str) -> int:
+        return self.var_index[name]
+
+    def add_constr(self, lhs: LinSum | float, rhs: LinSum | float, name: str = None, group: str = None) -> int:
+        """adds the linear row lhs == rhs, either side being a LinSum or a constant"""
+        lhs_sum = lhs if isinstance(lhs, dict) else {}
+        rhs_sum = rhs if isinstance(rhs, dict) else {}
+        const = (0 if isinstance(rhs, dict) else float(rhs)) - (0 if isinstance(lhs, dict) else float(lhs))
+
+        coeffs = lin_sub(lhs_sum, rhs_sum)
+        self.row_names.append(name if name is not None else f'R{len(self.row_names)}')
+        self.row_index[self.row_names[-1]] = len(self.row_names) - 1
+        self.row_vars.append(list(coeffs.keys()))
+        self.row_coeffs.append(list(coeffs.values()))
+        self.rhs.append(const)
+        if group is not None:
+            self.group_rows.setdefault(group, []).append(len(self.row_names) - 1)
+        return len(self.row_names) - 1
+
+    def get_row_by_name(self, name: str) -> int:
+        return self.row_index[name]
+
+    def set_row(self, row: int, lhs: LinSum, rhs: float):
+        """replaces the coefficients and the right hand side of a row, in place"""
+        self.row_vars[row] = list(lhs.keys())
+        self.row_coeffs[row] = list(lhs.values())
+        self.rhs[row] = float(rhs)
+
+    def row_matrix(self):
+        """the linear rows as a sparse matrix A and right hand side b, A x == b"""
+        from scipy.sparse import csr_array
+        rows = np.repeat(np.arange(len(self.row_vars)), [len(r) for r in self.row_vars])
+        cols = np.fromiter((i for r in self.row_vars for i in r), dtype=np.int64, count=len(rows))
+        vals = np.fromiter((v for r in self.row_coeffs for v in r), dtype=np.float64, count=len(rows))
+        return (csr_array((vals, (rows, cols)), shape=(len(self.row_vars), self.num_vars())),
+                np.array(self.rhs, dtype=np.float64))
+
+    def remove_group(self, group: str) -> list[int]:
+        """empties the rows of a group (to 0 == 0) and returns them. rows keep their index until
+        compact drops them"""
+        rows = self.group_rows.pop(group, [])
+        for r in rows:
+            self.set_row(r, {}, 0)
+            if self.row_index.get(self.row_names[r]) == r:
+                del self.row_index[self.row_names[r]]
+        self.removed_rows.update(rows)
+        return rows
+
+    def compact(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """drops the rows emptied by remove_group, the vars no other row uses (directly, or as a
+        factor of an aux var one uses) and the definitions of the dropped aux vars. what is left
+        keeps its order. returns the maps from old to new var, row and aux definition indices,
+        -1 for the dropped ones"""
+        rows = [r for r in range(len(self.row_names)) if r not in self.removed_rows]
+        live = np.zeros(self.num_vars(), dtype=bool)
+        stack = list({v for r in rows for v in self.row_vars[r]})
+        while stack:
+            v = stack.pop()
+            if not live[v]:
+                live[v] = True
+                p = self.var_product.get(v)
+                if p is not None:
+                    stack.extend((self.prod_x[p], self.prod_y[p]))
+        prods = [p for p in range(len(self.prod_names)) if live[self.prod_z[p]]]
+
+        var_map = np.full(self.num_vars(), -1, dtype=np.int64)
+        var_map[live] = np.arange(int(live.sum()))
+        row_map = np.full(len(self.row_names), -1, dtype=np.int64)
+        row_map[rows] = np.arange(len(rows))
+        prod_map = np.full(len(self.prod_names), -1, dtype=np.int64)
+        prod_map[prods] = np.arange(len(prods))
+
+        kept = np.flatnonzero(live).tolist()
+        self.var_names = [self.var_names[v] for v in kept]
+        self.var_index = {n: i for i, n in enumerate(self.var_names)}
+        self.lb = [self.lb[v] for v in kept]
+        self.ub = [self.ub[v] for v in kept]
+        self.row_names = [self.row_names[r] for r in rows]
+        self.row_index = {n: i for i, n in enumerate(self.row_names)}
+        self.row_vars = [[int(var_map[v]) for v in self.row_vars[r]] for r in rows]
+        self.row_coeffs = [self.row_coeffs[r] for r in rows]
+        self.rhs = [self.rhs[r] for r in rows]
+        self.group_rows = {g: [int(row_map[r]) for r in rs] for g, rs in self.group_rows.items()}
+        self.removed_rows = set[int]()
+        self.prod_names = [self.prod_names[p] for p in prods]
+        self.prod_z = [int(var_map[self.prod_z[p]]) for p in prods]
+        self.prod_x = [int(var_map[self.prod_x[p]]) for p in prods]
+        self.prod_y = [int(var_map[self.prod_y[p]]) for p in prods]
+        self.var_product = {z: p for p, z in enumerate(self.prod_z)}
+        return var_map, row_map, prod_map
+
+    def add_product(self, x: int, y: int, name: str) -> int:
+        """adds an aux var z with the bilinear definition z == x * y, returns z"""
+        z = self.add_var(name)
+        self.__add_product_def(z, x, y, f'c_{name}')
+        return z
+
+    def __add_product_def(self, z: int, x: int, y: int, name: str):
+        self.var_product[z] = len(self.prod_names)
+        self.prod_names.append(name)
+        self.prod_z.append(z)
+        self.prod_x.append(x)
+        self.prod_y.append(y)
+
+    def restrict(self, groups: list[str], roots: list[int]) -> tuple['Problem', dict[int, int]]:
+        """the subproblem made of the rows of the given groups, plus the definitions of every
+        aux var they (or the root vars) use. returns it with the map from old to new var indices"""
+        rows = sorted(r for g in groups for r in self.group_rows.get(g, []))
+        keep = set(roots)
+        for r in rows:
+            keep.update(self.row_vars[r])
+
+        #pull in the definitions of the aux vars used, and the factors those need in turn
+        prods = list[int]()
+        stack = list(keep)
+        while stack:
+            p = self.var_product.get(stack.pop())
+            if p is not None:
+                prods.append(p)
+                for v in (self.prod_x[p], self.prod_y[p]):
+                    if v not in keep:
+                        keep.add(v)
+                        stack.append(v)
+
+        var_map = {v: i for i, v in enumerate(sorted(keep))}
+        sub = Problem(self.name)
+        for v in var_map:
+            sub.add_var(self.var_names[v], self.lb[v], self.ub[v])
+        group_of = {r: g for g in groups for r in self.group_rows.get(g, [])}
+        for r in rows:
+            sub.add_constr({var_map[v]: c for v, c in zip(self.row_vars[r], self.row_coeffs[r])},
+                           self.rhs[r], self.row_names[r], group_of[r])
+        for p in sorted(prods):
+            sub.__add_product_def(var_map[self.prod_z[p]], var_map[self.prod_x[p]],
+                                  var_map[self.prod_y[p]], self.prod_names[p])
+        return sub, var_map
+
+#statuses of a solve cut short by a limit, its best solution and bound are still valid
+LIMIT_STATUSES = {'TIME_LIMIT', 'NODE_LIMIT', 'ITERATION_LIMIT', 'WORK_LIMIT', 'MEM_LIMIT', 'INTERRUPTED', 'SUBOPTIMAL'}
+
+class SolveResult:
+    def __init__(self, status: str, obj_val: float = None, runtime: float = 0, node_count: int = 0,
+                 obj_bound: float = None):
+        self.status = status
+        #best feasible objective value found
+        self.obj_val = obj_val
+        self.runtime = runtime
+        self.node_count = node_count
+        #bound on the optimum proven by the solver, below it when minimizing and above it when
+        #   maximizing (None if the solver didn't get that far)
+        self.obj_bound = obj_bound
+
+    @property
+    def optimal(self) -> bool:
+        return self.status == 'OPTIMAL'
+
+    @property
+    def limited(self) -> bool:
+        """stopped by a limit rather than proven optimal or infeasible"""
+        return self.status in LIMIT_STATUSES
+
+class Solver(ABC):
+    """a Problem compiled for a particular solver"""
+    def __init__(self, problem: Problem):
+        self.problem = problem
+
+    @abstractmethod
+    def solve(self, objective: int, sense: int, linear: bool = False, time_limit: float = None) -> SolveResult:
+        """optimizes the var objective, linear tells the objective only depends on one correlation class.
+        time_limit (seconds) stops the solve early, with whatever solution and bound it has by then"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def solve_lin_sum(self, objective: LinSum, sense: int, time_limit: float = None) -> SolveResult:
+        """optimizes a linear sum over the problem's vars, dropping the bilinear definitions
+        like a linear objective would"""
+        raise NotImplementedError
+
+    def solve_batch(self, jobs: list[tuple[int, int, bool]], time_limit: float = None) -> list[SolveResult]:
+        """solves many (objective, sense, linear) jobs against the same constraints"""
+        return [self.solve(*job, time_limit=time_limit) for job in jobs]
+
+    @abstractmethod
+    def set_var_bounds(self, var: int, lb: float, ub: float):
+        raise NotImplementedError
+
+    @abstractmethod
+    def update_rows(self, rows: list[int]):
+        """picks up rows of the problem changed with Problem.set_row, without recompiling"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def update_problem(self, var_map: np.ndarray, row_map: np.ndarray, prod_map: np.ndarray, rows: list[int]):
+        """picks up a compacted and extended problem without recompiling: drops what
+        Problem.compact dropped (var_map, row_map and prod_map are what it returned), adds the
+        vars, rows and aux definitions added since, and updates the rows (new indices) changed
+        with Problem.set_row"""
+        raise NotImplementedError
+
+class GurobiSolver(Solver):
+    #one env (and license checkout) per thread, shared by every model compiled on it
+    #   (gurobi envs and models must not be used from several threads at once)
+    _envs = threading.local()
+
+    def __init__(self, problem: Problem):
+        super().__init__(problem)
+        import gurobipy as gp
+        from gurobipy import GRB
+        self.gp = gp
+        self.status_names = {getattr(GRB.Status, i): i for i in dir(GRB.Status) if i.isupper()}
+
+        env = getattr(GurobiSolver._envs, 'env', None)
+        if env is None:
+            env = gp.Env(empty=True)
+            env.setParam("OutputFlag", 0)
+            env.start()
+            GurobiSolver._envs.env = env
+
+        #the whole system goes in through the matrix api, a handful of calls instead of one
+        #   per var and row
+        m = gp.Model(problem.name, env=env)
+        x = m.addMVar(problem.num_vars(), lb=np.array(problem.lb), ub=np.array(problem.ub), name=problem.var_names)
+        self.vars = x.tolist()
+        a_eq, b_eq = problem.row_matrix()
+        self.constrs = m.addMConstr(a_eq, x, GRB.EQUAL, b_eq, name=problem.row_names).tolist() if len(b_eq) > 0 else []
+        self.qconstrs = []
+        if len(problem.prod_names) > 0:
+            #elementwise z == x * y over every aux definition at once
+            self.qconstrs = m.addConstr(x[problem.prod_z] == x[problem.prod_x] * x[problem.prod_y]).tolist()
+            m.update()
+            m.setAttr('QCName', self.qconstrs, problem.prod_names)
+            m.setParam('NonConvex', 2)
+        m.update()
+        self.model = m
+
+        #copy of the model without the bilinear constraints, see get_lp_model
+        self.lp_model = None
+        self.lp_vars = None
+        self.lp_constrs = None
+
+    def get_lp_model(self):
+        """copy of the model without its bilinear constraints
+
+        the bilinear constraints only define aux vars as products of sym vars, and any assignment of
+        the sym vars extends to the aux vars, so dropping them doesn't change the feasible sym vars.
+        an objective over a single correlation class is then a plain LP"""
+        if self.lp_model is None:
+            self.lp_model = self.model.copy()
+            self.lp_model.remove(self.lp_model.getQConstrs())
+            self.lp_model.update()
+            self.lp_vars = self.lp_model.getVars()
+            #the linear rows keep their order in the copy
+            self.lp_constrs = self.lp_model.getConstrs()
+        return self.lp_model, self.lp_vars
+
+    def solve(self, objective: int, sense: int, linear: bool = False, time_limit: float = None) -> SolveResult:
+        #linear objectives take the LP path, everything else the (non-convex) full model
+        m, grb_vars = self.get_lp_model() if linear else (self.model, self.vars)
+        m.setObjective(grb_vars[objective], sense)
+        m.Params.TimeLimit = time_limit if time_limit is not None else self.gp.GRB.INFINITY
+        m.optimize()
+
+        result = SolveResult(self.status_names.get(m.Status, str(m.Status)),
+                             m.ObjVal if m.SolCount > 0 else None, m.Runtime, self.get_node_count(m),
+                             self.get_obj_bound(m))
+        #all solves share the feasible region, seed the next one with this point
+        #   (LPs restart from the previous basis on their own)
+        if not linear:
+            self.warm_start(m, grb_vars)
+        return result
+
+    def solve_lin_sum(self, objective: LinSum, sense: int, time_limit: float = None) -> SolveResult:
+        m, grb_vars = self.get_lp_model()
+        m.setObjective(self.gp.LinExpr(list(objective.values()), [grb_vars[i] for i in objective]), sense)
+        m.Params.TimeLimit = time_limit if time_limit is not None else self.gp.GRB.INFINITY
+        m.optimize()
+        return SolveResult(self.status_names.get(m.Status, str(m.Status)),
+                           m.ObjVal if m.SolCount > 0 else None, m.Runtime, self.get_node_count(m),
+                           self.get_obj_bound(m))
+
+    def warm_start(self, m, grb_vars: list):
+        """uses the last solution found on m as the start point of its next solve"""
+        if m.SolCount > 0:
+            m.setAttr('Start', grb_vars, m.getAttr('X', grb_vars))
+
+    def get_obj_bound(self, m) -> float:
+        """the dual bound of the last solve, None if it stopped before having one"""
+        try:
+            return float(m.ObjBound)
+        except (self.gp.GurobiError, AttributeError):
+            #LPs have no ObjBound, the optimum bounds itself
+            return m.ObjVal if m.Status == self.gp.GRB.OPTIMAL else None
+
+    def get_node_count(self, m) -> int:
+        """branch-and-bound nodes explored by the last solve (0 if the solver didn't branch)"""
+        try:
+            return int(m.NodeCount)
+        except self.gp.GurobiError:
+            return 0
+
+    def set_var_bounds(self, var: int, lb: float, ub: float):
+        self.vars[var].LB = lb
+        self.vars[var].UB = ub
+        if self.lp_vars is not None:
+            self.lp_vars[var].LB = lb
+            self.lp_vars[var].UB = ub
+
+    def update_rows(self, rows: list[int]):
+        models = [(self.model, self.vars, self.constrs)]
+        if self.lp_model is not None:
+            models.append((self.lp_model, self.lp_vars, self.lp_constrs))
+        for m, grb_vars, constrs in models:
+            for r in rows:
+                c = constrs[r]
+                #clear the old coefficients, then set the new ones
+                old = m.getRow(c)
+                for k in range(old.size()):
+                    m.chgCoeff(c, old.getVar(k), 0.0)
+                for v, coeff in zip(self.problem.row_vars[r], self.problem.row_coeffs[r]):
+                    m.chgCoeff(c, grb_vars[v], coeff)
+                c.RHS = self.problem.rhs[r]
+            m.update()
+
+    def update_problem(self, var_map: np.ndarray, row_map: np.ndarray, prod_map: np.ndarray, rows: list[int]):
+        GRB = self.gp.GRB
+        problem, m = self.problem, self.model
+        dead = [c for c, i in zip(self.qconstrs, prod_map) if i < 0]
+        dead += [c for c, i in zip(self.constrs, row_map) if i < 0]
+        dead += [v for v, i in zip(self.vars, var_map) if i < 0]
+        m.remove(dead)
+        #what is left of the compiled model is a prefix of the problem, the rest is new
+        self.qconstrs = [c for c, i in zip(self.qconstrs, prod_map) if i >= 0]
+        self.constrs = [c for c, i in zip(self.constrs, row_map) if i >= 0]
+        self.vars = [v for v, i in zip(self.vars, var_map) if i >= 0]
+        changed = [r for r in rows if r < len(self.constrs)]
+
+        new = range(len(self.vars), problem.num_vars())
+        if len(new) > 0:
+            self.vars += m.addMVar(len(new), lb=np.array(problem.lb[new.start:]), ub=np.array(problem.ub[new.start:]),
+                                   name=problem.var_names[new.start:]).tolist()
+        for r in range(len(self.constrs), len(problem.row_names)):
+            expr = self.gp.LinExpr(problem.row_coeffs[r], [self.vars[v] for v in problem.row_vars[r]])
+            self.constrs.append(m.addLConstr(expr, GRB.EQUAL, problem.rhs[r], name=problem.row_names[r]))
+        for p in range(len(self.qconstrs), len(problem.prod_names)):
+            z, x, y = (self.vars[v] for v in (problem.prod_z[p], problem.prod_x[p], problem.prod_y[p]))
+            self.qconstrs.append(m.addQConstr(z == x * y, name=problem.prod_names[p]))
+        if len(problem.prod_names) > 0:
+            m.setParam('NonConvex', 2)
+        m.update()
+
+        #the lp copy is taken again when next needed
+        self.lp_model = None
+        self.lp_vars = None
+        self.lp_constrs = None
+        self.update_rows(changed)
+
+class HighsSolver(Solver):
+    """in-process LP backend on SciPy's HiGHS bindings
+
+    only handles linear objectives; the bilinear aux definitions are dropped (see
+    GurobiSolver.get_lp_model for why that keeps the feasible sym vars the same)"""
+    def __init__(self, problem: Problem):
+        super().__init__(problem)
+        from scipy.optimize import linprog
+        self.linprog = linprog
+        self.compile_rows()
+        self.bounds = np.array([problem.lb, problem.ub], dtype=np.float64).T
+
+    def compile_rows(self):
+        """the one constraint matrix all objectives are solved against"""
+        self.a_eq, self.b_eq = self.problem.row_matrix()
+
+    def solve(self, objective: int, sense: int, linear: bool = False, time_limit: float = None) -> SolveResult:
+        if not linear:
+            return SolveResult('UNSUPPORTED')
+        return self.solve_lin_sum({objective: 1.0}, sense, time_limit)
+
+    def solve_lin_sum(self, objective: LinSum, sense: int, time_limit: float = None) -> SolveResult:
+        c = np.zeros(self.problem.num_vars())
+        for i, v in objective.items():
+            c[i] = sense * v
+        options = {'time_limit': time_limit} if time_limit is not None else None
+        start = time.perf_counter()
+        res = self.linprog(c, A_eq=self.a_eq, b_eq=self.b_eq, bounds=self.bounds, method='highs', options=options)
+        runtime = time.perf_counter() - start
+        if res.status == 0:
+            return SolveResult('OPTIMAL', sense * res.fun, runtime, obj_bound=sense * res.fun)
+        if res.status == 1:
+            #linprog reports the time limit as an iteration limit
+            return SolveResult('TIME_LIMIT' if time_limit is not None else 'ITERATION_LIMIT', None, runtime)
+        return SolveResult('INFEASIBLE' if res.status == 2 else res.message, None, runtime)
+
+    def set_var_bounds(self, var: int, lb: float, ub: float):
+        self.bounds[var] = (lb, ub)
+
+    def update_rows(self, rows: list[int]):
+        #rebuilding the sparse matrix is about as cheap as patching it
+        self.compile_rows()
+
+    def update_problem(self, var_map: np.ndarray, row_map: np.ndarray, prod_map: np.ndarray, rows: list[int]):
+        #bounds set on the vars that are kept stay, the new vars get the problem's
+        bounds = np.array([self.problem.lb, self.problem.ub], dtype=np.float64).T
+        kept = var_map[:len(self.bounds)] >= 0
+        bounds[var_map[:len(self.bounds)][kept]] = self.bounds[kept]
+        self.bounds = bounds
+        self.compile_rows()
+
+#selectable from base.py (--solver)
+solver_backends = {
+    'gurobi': GurobiSolver,
+    'highs': HighsSolver,
+}
@@ -0,0 +1,146 @@
+import os
+import mmap
+import pickle
+import tempfile
+from collections import OrderedDict
+from itertools import count
+
+# memory bounded store for the expressions of ctx.expressions
+#
+# intermediate output facts are only needed until every fact whose rules use them has been
+#   built, so the store counts their pending consumers (see set_consumers) and drops an
+#   expression as soon as its last consumer releases it. with a RAM budget set, the least
+#   recently used expressions beyond the budget are spilled to files in a scratch directory
+#   and memory mapped back in on demand. numpy coefficients are written out of band, so a
+#   reloaded tensor expression reads straight from the mapped file
+
+class ExpressionStore:
+    def __init__(self):
+        #resident expressions in least to most recently used order, fact -> (expression, bytes)
+        self.resident = OrderedDict()
+        #facts with a spill file, fact -> (path, pickle length, out of band buffer lengths)
+        self.spilled = dict[str, tuple[str, int, list[int]]]()
+        #pending consumers of the intermediate facts, facts without an entry are kept for good
+        self.consumers = dict[str, int]()
+        #RAM budget in bytes, None means no spilling
+        self.budget: int = None
+        self.spill_dir: str = None
+        self.__tmp = None
+        self.__file_ids = count()
+        self.resident_bytes = 0
+        self.peak_bytes = 0
+        self.num_spills = 0
+        self.num_loads = 0
+        self.num_evictions = 0
+
+    def set_budget(self, budget: int, spill_dir: str = None):
+        """spill beyond budget bytes, into spill_dir (a fresh temporary directory by default)"""
+        self.budget = budget
+        if spill_dir is not None:
+            os.makedirs(spill_dir, exist_ok=True)
+        self.__tmp = tempfile.TemporaryDirectory(prefix='exprs-', dir=spill_dir)
+        self.spill_dir = self.__tmp.name
+
+    def set_consumers(self, consumers: dict[str, int]):
+        self.consumers = dict(consumers)
+
+    def __contains__(self, fact: str) -> bool:
+        return fact in self.resident or fact in self.spilled
+
+    def __len__(self) -> int:
+        return len(self.resident.keys() | self.spilled.keys())
+
+    def __setitem__(self, fact: str, e):
+        self.__drop(fact)
+        self.__make_resident(fact, e)
+
+    def __getitem__(self, fact: str):
+        if fact in self.resident:
+            self.resident.move_to_end(fact)
+            return self.resident[fact][0]
+        if fact not in self.spilled:
+            raise KeyError(fact)
+        e = self.__load(fact)
+        self.__make_resident(fact, e)
+        return e
+
+    def get(self, fact: str, default=None):
+        return self[fact] if fact in self else default
+
+    def discard(self, fact: str):
+        """drops the expression of fact, if there is one"""
+        self.__drop(fact)
+        self.consumers.pop(fact, None)
+
+    def release(self, fact: str):
+        """one consumer of fact is done with it, the expression is dropped after the last one"""
+        n = self.consumers.get(fact)
+        if n is None:
+            return
+        if n > 1:
+            self.consumers[fact] = n - 1
+        else:
+            del self.consumers[fact]
+            self.__drop(fact)
+            self.num_evictions += 1
+
+    def __make_resident(self, fact: str, e):
+        size = e.nbytes()
+        self.resident[fact] = (e, size)
+        self.resident_bytes += size
+        self.peak_bytes = max(self.peak_bytes, self.resident_bytes)
+        self.__enforce_budget(fact)
+
+    def __enforce_budget(self, keep: str):
+        """spills the least recently used expressions (other than keep) until within budget"""
+        if self.budget is None:
+            return
+        for fact in list(self.resident):
+            if self.resident_bytes <= self.budget:
+                break
+            if fact != keep:
+                self.__spill(fact)
+
+    def __spill(self, fact: str):
+        e, size = self.resident.pop(fact)
+        self.resident_bytes -= size
+        #expressions never change once stored, so an existing spill file is still good
+        if fact in self.spilled:
+            return
+        buffers = list[pickle.PickleBuffer]()
+        data = pickle.dumps(e, protocol=5, buffer_callback=buffers.append)
+        path = os.path.join(self.spill_dir, f'{next(self.__file_ids)}.bin')
+        lengths = list[int]()
+        with open(path, 'wb') as f:
+            f.write(data)
+            for b in buffers:
+                raw = b.raw()
+                lengths.append(raw.nbytes)
+                f.write(raw)
+        self.spilled[fact] = (path, len(data), lengths)
+        self.num_spills += 1
+
+    def __load(self, fact: str):
+        path, length, lengths = self.spilled[fact]
+        with open(path, 'rb') as f:
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(m)
+        buffers = list[memoryview]()
+        offset = length
+        for n in lengths:
+            buffers.append(view[offset:offset + n])
+            offset += n
+        self.num_loads += 1
+        return pickle.loads(view[:length], buffers=buffers)
+
+    def __drop(self, fact: str):
+        if fact in self.resident:
+            self.resident_bytes -= self.resident.pop(fact)[1]
+        if fact in self.spilled:
+            os.remove(self.spilled.pop(fact)[0])
+
+    def stats(self) -> str:
+        s = f'peak resident expressions: {self.peak_bytes / 2**20:.1f} MiB, {self.num_evictions} freed after their last consumer'
+        if self.budget is not None:
+            s += f', {self.num_spills} spilled to {self.spill_dir}, {self.num_loads} reloaded'
+        return s
@@ -1,281 +1,1384 @@
 import sys
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from typing import Tuple
-from gurobipy import Model, GRB, quicksum, Var
 from defs import *
+from solver import Problem, SolveResult, solver_backends, lin_sub, MINIMIZE, MAXIMIZE
+from reader import ParsedGraph, parse_scenario, parse_delta
+import os
+import time
 from decimal import Decimal
 
-def read_facts(ctx: Context, gob):
-    test_dir = getattr(gob, 'args').testdir
+def to_decimal(p: float) -> Decimal:
+    """the Decimal a probability was written as in the input (1, not 1.0)"""
+    return Decimal(int(p)) if p.is_integer() else Decimal(repr(p))
 
-    file = open(test_dir + '/facts.txt')
-    for line in file.readlines():
-        line = line.strip()
-        if line:
-            toks = line.split(' ')
-            if len(toks) != 2 :
-                sys.exit('unexpected number of tokens in facts.txt')
-            else:
-                ctx.facts[toks[0]] = Decimal(toks[1])
+def read_facts(ctx: Context, graph: ParsedGraph):
+    names = graph.names
+    for (i, p) in zip(graph.fact_ids.tolist(), graph.fact_probs.tolist()):
+        ctx.facts[names[i]] = to_decimal(p)
 
     
-def read_deps(ctx: Context, gob):
-    test_dir = getattr(gob, 'args').testdir
-
-    file = open(test_dir + '/edges.txt')
-    for line in file.readlines():
-        line = line.strip()
-        if line:
-            toks = line.split(' ')
-            if len(toks) != 3 :
-                sys.exit('unexpected number of tokens in edges.txt')
+def read_deps(ctx: Context, graph: ParsedGraph):
+    for r, (head, p) in enumerate(zip(graph.rule_heads.tolist(), graph.rule_probs.tolist())):
+        #represents the head of a rule
+        source_v = graph.names[head]
+        #represents the body of a rule, potentially a list of events
+        dest_vs = graph.rule_body(r)
+        #represents the probability associated with the rule
+        cond_prob = to_decimal(p)
+
+        if source_v in ctx.facts:
+            # this represents a dependency b/w input facts
+            # (the reader already checked that all of dest_vs are facts)
+
+            #only save valid conditional probs (this comes into play for the side-channel bms)
+            #  which use correlation classes to show that facts are related, without 
+            #  supplying the actual dependency.
+            if(cond_prob != -1):
+                ctx.fact_deps.setdefault(source_v, []).append((dest_vs, cond_prob))
             else:
-                #represents the head of a rule
-                source_v = toks[0]
-                #represents the body of a rule, potentially a list of events
-                dest_vs = toks[1].split(';')
-                #represents the probability associated with the rule
-                cond_prob = Decimal(toks[2])
-
-                if source_v in ctx.facts:
-                    # this represents a dependency b/w input facts
-                    for d in dest_vs:
-                        #sanity check
-                        assert d in ctx.facts, f'source {source_v} dep {d} not a fact'
-
-                    #only save valid conditional probs (this comes into play for the side-channel bms)
-                    #  which use correlation classes to show that facts are related, without 
-                    #  supplying the actual dependency.
-                    if(cond_prob != -1):
-                        ctx.fact_deps.setdefault(source_v, []).append((dest_vs, cond_prob))
-
-                    # save off an undirected version, for convenence
-                    for d in dest_vs:
-                        ctx.facts_undirected.setdefault(source_v, []).append(d)
-                        ctx.facts_undirected.setdefault(d, []).append(source_v)
-                    
-                else:
-                    # this represents a dependency for an output fact
-                    ctx.output_deps.setdefault(source_v, []).append((dest_vs, cond_prob))
+                ctx.side_channels.setdefault(source_v, []).append(dest_vs)
 
+        else:
+            # this represents a dependency for an output fact
+            ctx.output_deps.setdefault(source_v, []).append((dest_vs, cond_prob))
 
-def dfs(undirected: dict[str, list[str]], tmp: list[str], f: str, visited: set[str]):
-    visited.add(f)
-    tmp.append(f)
+    #connected components of the input facts, labelled by the reader's union-find
+    components = dict[int, list[str]]()
+    seen = set[str]()
+    for (i, c) in zip(graph.fact_ids.tolist(), graph.fact_class.tolist()):
+        f = graph.names[i]
+        if f not in seen:
+            seen.add(f)
+            components.setdefault(c, []).append(f)
+    ctx.fact_components = list(components.values())
 
-    if f in undirected:
-        for v in undirected[f]:
-          if v not in visited:
-            tmp = dfs(undirected, tmp, v, visited)  
-    return tmp
 
 def fact_connected(ctx: Context) -> list[list[str]]:
-    visited = set[str]()
-    cc = list[list[str]]()
-    for f in ctx.facts:
-        if f not in visited:
-            tmp = list[str]()
-            cc.append(dfs(ctx.facts_undirected, tmp, f, visited))
-    
-    return cc
+    return ctx.fact_components
+
+
+def select_queries(ctx: Context, gob):
+    """restricts the run to the cone of influence of the --query facts (all output facts by default)"""
+    query = getattr(getattr(gob, 'args'), 'query', None)
+    if not query:
+        return
+
+    ctx.queries = query.split(',')
+    for q in ctx.queries:
+        if q not in ctx.output_deps:
+            sys.exit(f'query {q} is not an output fact')
+
+    reached = query_cone(ctx)
+    ctx.relevant_facts = {f for f in reached if f in ctx.facts}
+    print(f'cone of influence of {ctx.queries}: {len(reached) - len(ctx.relevant_facts)} of {len(ctx.output_deps)} '
+          f'output facts, {len(ctx.relevant_facts)} of {len(ctx.facts)} input facts')
 
+def query_cone(ctx: Context) -> set[str]:
+    """the facts the queries depend on, walking the rule graph backwards from them"""
+    reached = set[str]()
+    stack = list(ctx.queries)
+    while stack:
+        f = stack.pop()
+        if f not in reached:
+            reached.add(f)
+            for (body, _) in ctx.output_deps.get(f, []):
+                stack.extend(body)
+    return reached
 
-def build_correlation_classes(ctx: Context):
-    """initializes correlation classes based on input facts"""
+def build_correlation_classes(ctx: Context, presolve: bool = True, cliques: bool = False):
+    """initializes correlation classes based on input facts, presolve drops the worlds the inputs
+    force to zero (see presolve_worlds) before their sym vars are created. with cliques, a class
+    is split along its dependencies into the tables of a junction tree (see decompose_class)"""
 
     fact_connected_comps = fact_connected(ctx)
-    correlation_class_prefix = 'V'
-    count = 0
+    groups = get_rule_groups(ctx)
+    built = list[list[str]]()
     for cc in fact_connected_comps:
-        cl = CorrelationClass(f'{correlation_class_prefix}{count}', cc, ctx.model)
-        ctx.correlation_classes.add(cl)
-        count += 1
+        #classes no query depends on are never built, but still counted so names stay stable
+        if build_class(ctx, cc, f'V{ctx.class_count}', presolve, cliques, groups) is not None:
+            built.append(cc)
+        ctx.class_count += 1
+
+    if ctx.relevant_facts is not None:
+        print(f'built {len(ctx.correlation_classes)} of {ctx.class_count} correlation classes')
+    #under --cliques the sym vars are over the tables, not over the whole classes
+    all_tables = [t for cl in ctx.correlation_classes for t in [cl] + ctx.clique_tables.get(cl, [])]
+    print_class_stats([t.facts for t in all_tables] if cliques else built, tables=cliques)
+    if cliques:
+        split = [cl for cl in ctx.correlation_classes if cl in ctx.clique_tables]
+        tables = [t for cl in split for t in [cl] + ctx.clique_tables[cl]]
+        print(f'clique decomposition: {len(split)} classes split into {len(tables)} tables of at most '
+              f'{max((len(t.facts) for t in tables), default=0)} facts, '
+              f'{sum(len(t.worlds) for t in tables)} table vars')
+    if presolve:
+        total = sum(1 << len(t.facts) for t in all_tables)
+        kept = sum(len(t.worlds) for t in all_tables)
+        print(f'presolve: {total - kept} of {total} worlds forced to 0 and dropped')
+
+def get_rule_groups(ctx: Context) -> dict[str, int]:
+    """the output facts (of the queries' cone) and the input facts in their rule bodies, numbered
+    by the connected component of the rule graph they are in. the expression of an output fact
+    only ever combines input facts of its own group, and those of a correlation class are kept
+    on one of its tables (see decompose_class)"""
+    outputs = ctx.output_deps if ctx.queries is None else [f for f in query_cone(ctx) if f in ctx.output_deps]
+    parent = {f: f for f in outputs}
+    def find(f: str) -> str:
+        while parent[f] != f:
+            parent[f] = parent[parent[f]]
+            f = parent[f]
+        return f
+    for head in outputs:
+        for (body, _) in ctx.output_deps[head]:
+            for d in body:
+                parent.setdefault(d, d)
+                parent[find(d)] = find(head)
+    roots = dict[str, int]()
+    return {f: roots.setdefault(find(f), len(roots)) for f in parent}
+
+def build_class(ctx: Context, cc: list[str], name: str, presolve: bool, cliques: bool, groups: dict[str, int]) -> CorrelationClass:
+    """the correlation class of the connected component cc (None if no query depends on it), and
+    the expressions of the facts of cc the rules use (see get_rule_groups), over its tables"""
+    if not any(ctx.is_relevant(f) for f in cc):
+        return None
+    uses = dict[int, set[str]]()
+    for f in cc:
+        if f in groups:
+            uses.setdefault(groups[f], set()).add(f)
+    uses = list(uses.values())
+    tables, edges, at = decompose_class(ctx, cc, uses) if cliques else ([cc], [], [0] * len(uses))
+    q = at[0] if at else 0
+    cl = CorrelationClass(name, tables[q], ctx.problem,
+                          (lambda cl: presolve_worlds(ctx, cl)) if presolve else None)
+    if len(cl.worlds) == 0:
+        sys.exit(f'inconsistent inputs, every world of correlation class {cl.get_name()} ({", ".join(cc)}) has probability 0')
+    ctx.correlation_classes.add(cl)
+    ctx.fact_to_class.update(dict.fromkeys(cc, cl))
+    nodes = [cl]
+    if len(tables) > 1:
+        #a clique of the rule facts stands in for the class, the others are tables with
+        #   constraints of their own, in the class' row group
+        nodes = [cl if k == q else CorrelationClass(f'{name}c{k}', t, ctx.problem, group=name) for k, t in enumerate(tables)]
+        ctx.clique_tables[cl] = [t for t in nodes if t is not cl]
+        ctx.clique_edges[cl] = [(nodes[i], nodes[j]) for (i, j) in edges]
+    for u, k in zip(uses, at):
+        for f in u:
+            get_expression_for_fact(f, nodes[k], ctx)
+    return cl
+
+def decompose_class(ctx: Context, facts: list[str], uses: list[set[str]]) -> Tuple[list[list[str]], list[Tuple[int, int]], list[int]]:
+    """splits a class into the cliques of a junction tree: every INPUTDEP rule, and each set of
+    facts of the class that the output rules use together (uses), fall within one clique. returns
+    the cliques, the tree edges and the clique holding each of uses
+
+    joint tables over the cliques that agree on their separators are exactly the marginals of some
+    joint distribution over the whole class, so bounds only depending on facts within one clique
+    come out the same, at the cost of 2^(largest clique) rather than 2^(class size) vars. an
+    expression over the facts of one of uses is built on the sym vars of its clique alone"""
+    sets = [{f} | set(deps) for f in facts for (deps, _) in ctx.fact_deps.get(f, [])]
+    sets.extend(uses)
+    cliques, edges = junction_tree(facts, sets)
+    at = [next(k for k, c in enumerate(cliques) if u <= set(c)) for u in uses]
+    return cliques, edges, at
+
+def junction_tree(facts: list[str], sets: list[set[str]]) -> Tuple[list[list[str]], list[Tuple[int, int]]]:
+    """maximal cliques of a triangulation (min-fill elimination) of the graph over facts in which
+    each of sets is complete, and the edges of a junction tree over them (facts keep their order)"""
+    order = {f: i for i, f in enumerate(facts)}
+    adj = {f: set[str]() for f in facts}
+    for s in sets:
+        for f in s:
+            adj[f] |= s - {f}
+
+    def fill(v: str) -> int:
+        nb = sorted(adj[v], key=order.get)
+        return sum(1 for i, a in enumerate(nb) for b in nb[i + 1:] if b not in adj[a])
+
+    elim = list[frozenset[str]]()
+    remaining = set(facts)
+    while remaining:
+        v = min(remaining, key=lambda v: (fill(v), len(adj[v]), order[v]))
+        nb = adj.pop(v)
+        elim.append(frozenset(nb | {v}))
+        for a in nb:
+            adj[a] |= nb - {a}
+            adj[a].discard(v)
+        remaining.remove(v)
+
+    #the maximal cliques of the triangulation are among the elimination cliques
+    cliques = list[frozenset[str]]()
+    for c in elim:
+        if c not in cliques and not any(c < d for d in elim):
+            cliques.append(c)
 
-def build_constraints(ctx: Context):
-    """adds the three types of constraints described in Fig 6"""
-    add_sum_to_one_constraints(ctx)
-    add_marginal_prob_constraints(ctx)
-    add_dep_constraints(ctx)
+    #maximum spanning tree on the separator sizes (kruskal), empty separators need no edge
+    parent = list(range(len(cliques)))
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+    pairs = sorted(((len(cliques[i] & cliques[j]), i, j) for i in range(len(cliques)) for j in range(i + 1, len(cliques))), reverse=True)
+    edges = list[Tuple[int, int]]()
+    for w, i, j in pairs:
+        if w > 0 and find(i) != find(j):
+            parent[find(i)] = find(j)
+            edges.append((i, j))
+    return [sorted(c, key=order.get) for c in cliques], edges
 
-    ctx.model.update()
-    #sanity
-    #ctx.model.write("constraints-only.lp")
+def presolve_worlds(ctx: Context, cl: CorrelationClass) -> np.ndarray:
+    """which worlds of a class the inputs don't force to probability 0
+
+    a marginal of 0 (1) rules out the worlds where the fact holds (doesn't hold). a conditional
+    probability of 1 rules out the worlds where the body holds but the head doesn't, and one of 0
+    the worlds where both hold. these worlds are 0 in every solution, so dropping them is exact"""
+    keep = np.ones(len(cl.worlds), dtype=bool)
+    holds = {f: (cl.worlds & np.uint64(cl.get_mask_of_fact(f))) != 0 for f in cl.facts}
+    for f in cl.facts:
+        if ctx.facts[f] == 0:
+            keep &= ~holds[f]
+        elif ctx.facts[f] == 1:
+            keep &= holds[f]
+        for deps, cond_prob in ctx.fact_deps.get(f, []):
+            if not all(d in holds for d in deps):
+                #a rule of another clique (see decompose_class)
+                continue
+            body = np.logical_and.reduce([holds[d] for d in deps])
+            if cond_prob == 1:
+                keep &= ~(body & ~holds[f])
+            elif cond_prob == 0:
+                keep &= ~(body & holds[f])
+    return keep
+
+def print_class_stats(components: list[list[str]], tables: bool = False):
+    """class (or clique table) sizes, the largest one decides the 2^n sym var cost"""
+    sizes = sorted(len(cc) for cc in components)
+    if not sizes:
+        return
+    hist = dict[int, int]()
+    for n in sizes:
+        hist[n] = hist.get(n, 0) + 1
+    print(f'{len(sizes)} {"clique tables" if tables else "correlation classes"}, sizes: min {sizes[0]}, median {sizes[len(sizes) // 2]}, '
+          f'max {sizes[-1]} (2^{sizes[-1]} sym vars), total {sum(1 << n for n in sizes)} sym vars')
+    print(f'\t{"table" if tables else "class"} size histogram: ' + ', '.join(f'{n}: {c}' for n, c in sorted(hist.items())))
+
+def build_constraints(ctx: Context, classes: list[CorrelationClass] = None):
+    """adds the three types of constraints described in Fig 6, for the given classes (all by default)"""
+    add_sum_to_one_constraints(ctx, classes)
+    add_marginal_prob_constraints(ctx, classes)
+    add_dep_constraints(ctx, classes)
+    add_clique_constraints(ctx, classes)
 
 #
-def add_sum_to_one_constraints(ctx : Context):
+def add_sum_to_one_constraints(ctx : Context, classes: list[CorrelationClass] = None):
     """applies Rule SUMONE in Fig 6"""
 
     #for each correlation class
-    for cl in ctx.correlation_classes:
+    for cl in ctx.correlation_classes if classes is None else classes:
         #add a constraint that sums all sym vars to 1 (Rule SUMONE in Fig 6)
-        ctx.model.addConstr(
-            quicksum(sym_var.grb_var for sym_var in cl.sym_vars) == 1,
-            f'sumToOne_{cl.get_name()}'
+        ctx.problem.add_constr(
+            {sym_var.var: 1.0 for sym_var in cl.sym_vars}, 1,
+            f'sumToOne_{cl.get_name()}', cl.get_name()
         )
 
-def add_marginal_prob_constraints(ctx : Context):
+def add_marginal_prob_constraints(ctx : Context, classes: list[CorrelationClass] = None):
     """applies Rule INPUTFACT in Fig 6"""
 
     # for each correlation class
-    for cl in ctx.correlation_classes:
+    for cl in ctx.correlation_classes if classes is None else classes:
         #for each fact in the correlation class
         for f in cl.facts:
             fact_prob = ctx.facts[f]
-            fact_index_in_class = cl.get_index_of_fact(f)
-            e = get_expression_for_fact(f, cl, ctx)
-            marginal_vars = []
-            for i, v in e.terms.items():
-                assert(len(i) == 1)
-                if v == 1:
-                    marginal_vars.append(list(i)[0].grb_var)
+            #worlds in which f holds, picked out with a bit test over the whole class
+            marginal_vars = [cl.sym_vars[i].var for i in cl.worlds_with_fact(f)]
 
             #add constraint based on Rule INPUTFACT in Fig 6)
-            sum = quicksum(marginal_vars)
-            ctx.model.addConstr(sum == float(fact_prob), f'c_{f}')
+            sum = dict.fromkeys(marginal_vars, 1.0)
+            ctx.problem.add_constr(sum, float(fact_prob), f'c_{f}', cl.get_name())
 
             #store off a copy of this expression if needed later
             cl.fact_sums[f] = sum
             
 
 
-def add_dep_constraints(ctx : Context):
+def add_dep_constraints(ctx : Context, classes: list[CorrelationClass] = None):
     """applies Rule INPUTDEP in Fig 6"""
 
     #for each correlation class
-    for cl in ctx.correlation_classes:
+    for cl in ctx.correlation_classes if classes is None else classes:
         #for each fact in the correlation class
         for f in cl.facts:
             #only if there are dependencies defined for this fact
             if f in ctx.fact_deps:
-                e_f = get_expression_for_fact(f, cl, ctx)
+                for k, (deps, cond_prob) in enumerate(ctx.fact_deps[f]):
+                    if not all(d in cl.fact_indices for d in deps):
+                        #placed on another clique table, see add_clique_constraints
+                        continue
+
+                    #build constraint by the InputDep rule. both sides lie within cl, so they are
+                    #   plain sums of sym vars: the joint (the worlds where f and the body hold) on
+                    #   the LHS, and on the RHS the sum of the body multiplied by the conditional
+                    #   probability
+                    lhs = table_sum(cl, [f] + deps)
+                    dep_sum = table_sum(cl, deps)
+
+                    ctx.problem.add_constr(lhs, scale_lin_sum(dep_sum, cond_prob), f'c_dep_{f}_{k}', cl.get_name())
+                    #kept to redo the row for another conditional probability, see apply_scenario
+                    ctx.dep_sums[f'c_dep_{f}_{k}'] = (lhs, dep_sum)
+
+def add_clique_constraints(ctx: Context, classes: list[CorrelationClass] = None):
+    """the rules of Fig 6 for the facts and dependencies of a decomposed class that fall outside
+    the clique of its sym vars, on the clique tables instead, plus the rows that make neighbouring
+    tables of the junction tree agree on the marginals of their separator"""
+    for cl in ctx.clique_tables if classes is None else [cl for cl in classes if cl in ctx.clique_tables]:
+        tables = ctx.clique_tables[cl]
+        group = cl.get_name()
+        nodes = [cl] + tables
+        for t in tables:
+            ctx.problem.add_constr({sv.var: 1.0 for sv in t.sym_vars}, 1, f'sumToOne_{t.get_name()}', group)
 
-                for (deps, cond_prob) in ctx.fact_deps[f]:
-                    first_dep = deps[0]
-                    e_dep = get_expression_for_fact(first_dep, cl, ctx)
-                    for dep in deps[1:]:
-                        e = get_expression_for_fact(dep, cl, ctx)
-                        e_dep = e_dep.mul(e)
-                    
-                    e_joint = e_f.mul(e_dep)
+        #INPUTFACT, once per fact on the first table that has it
+        done = set(cl.facts)
+        for t in tables:
+            for f in t.facts:
+                if f not in done:
+                    done.add(f)
+                    t.fact_sums[f] = table_sum(t, [f])
+                    ctx.problem.add_constr(t.fact_sums[f], float(ctx.facts[f]), f'c_{f}', group)
 
-                    #build constraint by the InputDep rule
-                    #obtain a GRB sum for the LHS
-                    joint_sum = e_joint.to_grb_sum(ctx)
-                    #multiply RHS by the conditional probability
-                    e_dep = e_dep.multiply_by_const(cond_prob)
-                    #obtain a GRB sum for the RHS
-                    dep_sum = e_dep.to_grb_sum(ctx)
+        #INPUTDEP, for the rules not within cl, on the first table that has all of their facts
+        for f in sorted({f for t in nodes for f in t.facts}):
+            for k, (deps, cond_prob) in enumerate(ctx.fact_deps.get(f, [])):
+                if all(d in cl.fact_indices for d in [f] + deps):
+                    continue
+                t = next(t for t in tables if all(d in t.fact_indices for d in [f] + deps))
+                lhs, dep_sum = table_sum(t, [f] + deps), table_sum(t, deps)
+                ctx.problem.add_constr(lhs, scale_lin_sum(dep_sum, cond_prob), f'c_dep_{f}_{k}', group)
+                ctx.dep_sums[f'c_dep_{f}_{k}'] = (lhs, dep_sum)
 
-                    #introduce an aux var, technically not required -- but readability.
-                    joint_var = ctx.model.addVar(vtype=GRB.CONTINUOUS, lb=0, ub=1)
-                    ctx.model.addConstr(joint_var == joint_sum)
+        for a, b in ctx.clique_edges[cl]:
+            sep = [f for f in a.facts if f in b.fact_indices]
+            codes_a, codes_b = separator_codes(a, sep), separator_codes(b, sep)
+            for s in np.union1d(codes_a, codes_b).tolist():
+                lhs = {a.sym_vars[i].var: 1.0 for i in np.flatnonzero(codes_a == s).tolist()}
+                rhs = {b.sym_vars[i].var: 1.0 for i in np.flatnonzero(codes_b == s).tolist()}
+                ctx.problem.add_constr(lhs, rhs, f'sep_{a.get_name()}_{b.get_name()}_{s}', group)
 
-                    ctx.model.addConstr(joint_var == dep_sum)
+def table_sum(t: CorrelationClass, facts: list[str]) -> LinSum:
+    """sum of the vars of the worlds of a table in which all of facts hold"""
+    mask = np.uint64(sum(t.get_mask_of_fact(f) for f in set(facts)))
+    return {t.sym_vars[i].var: 1.0 for i in np.flatnonzero((t.worlds & mask) == mask).tolist()}
 
+def separator_codes(t: CorrelationClass, sep: list[str]) -> np.ndarray:
+    """the assignment to the separator facts in each world of a table, as a bitmask"""
+    codes = np.zeros(len(t.worlds), dtype=np.uint64)
+    for j, f in enumerate(sep):
+        codes |= ((t.worlds & np.uint64(t.get_mask_of_fact(f))) != 0).astype(np.uint64) << np.uint64(j)
+    return codes
 
-def make_grb_var(m: Model, name: str) -> Var:
-    return m.addVar(vtype=GRB.CONTINUOUS, lb=0, ub=1, name=name)
+def scale_lin_sum(s: LinSum, c: Decimal) -> LinSum:
+    return {i: float(Decimal(v) * c) for i, v in s.items()}
+
+def is_linear(e) -> bool:
+    """an expression over a single correlation class is a plain weighted sum of sym vars"""
+    return len(e.get_correlation_classes_used()) <= 1
+
+def make_var(problem: Problem, name: str) -> int:
+    return problem.add_var(name, lb=0, ub=1)
 
 def get_expression_for_fact(fact: str, corr_class: CorrelationClass, ctx: Context) -> Expression:
     if fact in ctx.expressions:
         return ctx.expressions[fact]
     else:
-        e = Expression()
+        e = ctx.expression_type()
         e.init_for_fact(fact, corr_class)
         ctx.expressions[fact] = e
         return e
 
-def build_expressions(ctx: Context):
-    """recursively build expressions for each unknown fact
-    (EXPENSIVE)"""
+def build_expressions(ctx: Context, jobs: int = 1, mem_budget: int = None, spill_dir: str = None,
+                      keep_all: bool = False):
+    """build expressions for each unknown fact, and every output fact they depend on
+    (EXPENSIVE)
 
-    #by this point, all facts should have expressions ready, so assert that
-    for f in ctx.facts:
-        assert(f in ctx.expressions)
-    
-    for f in ctx.output_deps:
-        e = build_expr(f, ctx)
-        ctx.expressions[f] = e
+    mem_budget (bytes) caps the expressions kept in memory, the rest are spilled to spill_dir.
+    keep_all keeps the intermediate expressions around (to rebuild after a change, see apply_scenario)"""
+
+    #by this point, all (relevant) facts the rules use should have expressions ready, so assert that
+    for f in {d for rules in ctx.output_deps.values() for (body, _) in rules for d in body if d in ctx.facts}:
+        assert(f in ctx.expressions or not ctx.is_relevant(f))
+
+    levels = schedule_rules(ctx, ctx.get_queries())
+    print(f'building expressions for {sum(map(len, levels))} output facts in {len(levels)} levels')
+
+    #intermediate output facts can be dropped once every fact using them is built,
+    #   the queries are kept for the objectives and the results
+    queries = set(ctx.get_queries())
+    consumers = dict[str, int]()
+    for level in levels if not keep_all else []:
+        for f in level:
+            for d in set(rule_children(ctx, f)) - queries:
+                consumers[d] = consumers.get(d, 0) + 1
+    ctx.expressions.set_consumers(consumers)
+    if mem_budget is not None:
+        ctx.expressions.set_budget(mem_budget, spill_dir)
+
+    if jobs <= 1:
+        for level in levels:
+            for f in level:
+                ctx.expressions[f] = build_expr(f, ctx)
+                release_children(ctx, f)
+    else:
+        build_levels_parallel(ctx, levels, jobs)
+    print(ctx.expressions.stats())
+
+def release_children(ctx: Context, event: str):
+    """event is built, so its rule bodies have one consumer less"""
+    for d in set(rule_children(ctx, event)):
+        ctx.expressions.release(d)
+
+def build_levels_parallel(ctx: Context, levels: list[list[str]], jobs: int):
+    """builds the expressions of levels (see schedule_rules) on a pool of jobs processes"""
+    #the output facts of a level only depend on lower levels, so each level is farmed out to
+    #   the pool at once. forked workers share the class/sym var tables the expressions
+    #   are pickled against (nothing gurobi related is alive at this point)
+    mp_ctx = multiprocessing.get_context('fork')
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=mp_ctx) as pool:
+        for level in levels:
+            if len(level) == 1:
+                ctx.expressions[level[0]] = build_expr(level[0], ctx)
+                release_children(ctx, level[0])
+                continue
+            tasks = list()
+            for f in level:
+                deps = ctx.output_deps[f]
+                children = {d: ctx.expressions[d] for (body, _) in deps for d in body}
+                tasks.append(pool.submit(combine_rules, deps, children))
+            for f, t in zip(level, tasks):
+                ctx.expressions[f] = t.result()
+                release_children(ctx, f)
+
+def schedule_rules(ctx: Context, roots: list[str]) -> list[list[str]]:
+    """topological pass over the rule graph below roots: the output facts to build, grouped
+    into levels so that a fact only depends on facts of lower levels. exits on a cycle"""
+    level = dict[str, int]()
+    on_stack = set[str]()
+    for root in roots:
+        if root in level:
+            continue
+        #iterative dfs, each entry is (fact, iterator over its children)
+        stack = [(root, iter(rule_children(ctx, root)))]
+        on_stack.add(root)
+        while stack:
+            f, children = stack[-1]
+            child = next(children, None)
+            if child is None:
+                #all children are done, f sits one level above the highest of them
+                stack.pop()
+                on_stack.remove(f)
+                level[f] = 1 + max((level[c] for c in rule_children(ctx, f)), default=0)
+            elif child in on_stack:
+                cycle = [g for (g, _) in stack]
+                cycle = cycle[cycle.index(child):] + [child]
+                sys.exit('cyclic rules: ' + ' -> '.join(cycle))
+            elif child not in level:
+                stack.append((child, iter(rule_children(ctx, child))))
+                on_stack.add(child)
+
+    levels = [list[str]() for _ in range(max(level.values(), default=0))]
+    for f, l in level.items():
+        levels[l - 1].append(f)
+    return levels
+
+def rule_children(ctx: Context, event: str) -> list[str]:
+    """the output facts in the bodies of event's rules"""
+    children = list[str]()
+    for (body, _) in ctx.output_deps[event]:
+        for d in body:
+            if d in ctx.output_deps:
+                children.append(d)
+            elif d not in ctx.facts:
+                sys.exit(f'{d} in a rule for {event} is neither an input fact nor the head of a rule')
+    return children
 
 def build_expr(event: str, ctx: Context) -> Expression:
-    """build expression for a given output fact"""
+    """build expression for a given output fact, from the (already built) expressions of its rule bodies"""
 
     if event in ctx.expressions:
         #already built
         return ctx.expressions[event]
     else:
         deps = ctx.output_deps[event]
-        tmp = list[Expression]()
-        for i, j in deps:
-            #for each outgoing edge, initialize e_conj with the 
-            #   first predicate in the body of the rule
-            e_conj = build_expr(i[0], ctx)
-            for d in i[1:]:
-                #apply rule EDGE in Fig 4 to obtain E = E1 \otimes E2 \otimes ... \otimes En
-                e_conj = e_conj.mul(build_expr(d, ctx))
+        return combine_rules(deps, {d: ctx.expressions[d] for (body, _) in deps for d in body})
 
-            #p * E
-            tmp.append(e_conj.multiply_by_const(j))
-        
-        #apply rule NODE in Fig 4 to obtain expression for the Node (i.e. the unknown fact)
-        e_disj = tmp[0]
-        for e in tmp[1:]:
-            e_disj = e_disj.add(e)
+def combine_rules(deps: list[Tuple[list[str], Decimal]], children: dict[str, Expression]) -> Expression:
+    """applies rules EDGE and NODE in Fig 4 to the rules of an output fact"""
+    tmp = list[Expression]()
+    for i, j in deps:
+        #for each outgoing edge, initialize e_conj with the 
+        #   first predicate in the body of the rule
+        e_conj = children[i[0]]
+        for d in i[1:]:
+            #apply rule EDGE in Fig 4 to obtain E = E1 \otimes E2 \otimes ... \otimes En
+            e_conj = e_conj.mul(children[d])
 
-        return e_disj
+        #p * E
+        tmp.append(e_conj.multiply_by_const(j))
+    
+    #apply rule NODE in Fig 4 to obtain expression for the Node (i.e. the unknown fact)
+    e_disj = tmp[0]
+    for e in tmp[1:]:
+        e_disj = e_disj.add(e)
 
+    return e_disj
 
 
 def build_objectives(ctx: Context):
     """build objectives for each unknown fact"""
 
-    for f in ctx.output_deps:
-        e = ctx.expressions[f]
-        sum = e.to_grb_sum(ctx)
+    for f in ctx.get_queries():
+        add_objective(ctx, f)
+
+    print(f'{len(ctx.linear_objectives)} linear and {len(ctx.get_queries()) - len(ctx.linear_objectives)} multilinear objectives')
+
+def add_objective(ctx: Context, f: str) -> int:
+    """adds the objective var obj_f and its row obj_f == E_f, or replaces the row of an existing
+    one after E_f was rebuilt. returns the row"""
+    problem = ctx.problem
+    e = ctx.expressions[f]
+    sum = e.to_lin_sum(ctx)
+    if f'c_obj_{f}' in problem.row_index:
+        r = problem.get_row_by_name(f'c_obj_{f}')
+        problem.set_row(r, lin_sub({problem.get_var_by_name(f'obj_{f}'): 1.0}, sum), 0)
+    else:
+        obj_var = make_var(problem, f'obj_{f}')
+        r = problem.add_constr({obj_var: 1.0}, sum, name = f'c_obj_{f}', group = f'obj_{f}')
+
+    #classify the objective, linear ones don't need the non-convex solver
+    if is_linear(e):
+        ctx.linear_objectives.add(f)
+    else:
+        ctx.linear_objectives.discard(f)
+    return r
 
-        obj_var = make_grb_var(ctx.model, f'obj_{f}')
-        ctx.model.addConstr(obj_var == sum, name = f'c_obj_{f}')
+def run_optimize(ctx: Context, gb, queries: list[str] = None):
+    """for each output fact (of queries, all by default), set up objective and optimize min/max
 
-def run_optimize(ctx: Context, gb):
-    """for each output fact, set up objective and optimize min/max"""
+    with a time budget (--time-limit per solve, --run-time-limit for all of them), a solve that
+    runs out of time still gives a sound outer bound on its side of the interval, see
+    side_bound. with --rounds N, the queries are solved in N rounds of doubling time limits, each
+    round only retrying the ones left relaxed, so every query has some interval early on"""
 
-    m = ctx.model
-    results = dict[str, Tuple[Decimal, Decimal]]()
+    args = getattr(gb, 'args')
+    deadline = None if args.run_time_limit is None else time.perf_counter() + args.run_time_limit
+    if args.jobs > 1:
+        run_optimize_parallel(ctx, args.solver, args.jobs, not args.monolithic, not args.no_factorize,
+                              args.time_limit, deadline, args.rounds, queries)
+        return
+
+    decompose = not args.monolithic
+    if not decompose:
+        #compile the constraint system for the selected solver, once (see run_deltas)
+        if ctx.solver is None:
+            ctx.solver = solver_backends[args.solver](ctx.problem)
+        solver = ctx.solver
     opt_runtime = 0
-    output_dir = getattr(gb, 'args').outdir
-    for out in ctx.output_deps:
-        obj_name = f'obj_{out}'
-        min = max = -1
-
-        print(f'\noptimizing {obj_name}')
-
-        objective = m.getVarByName(obj_name)
-        m.setObjective(objective, GRB.MINIMIZE)
-        #m.write(f"{output_dir}/LPs/min_{obj_name}.lp")
-        m.optimize()
-        if m.status == GRB.Status.OPTIMAL:
-            min = m.ObjVal
-            print(f'\tOptimal min {min}')
-            opt_runtime += m.Runtime
+    node_count = 0
+    early_stop = args.early_stop
+    factorize = not args.no_factorize
+    results, pending, same_as = plan_solves(ctx, ctx.get_queries() if queries is None else queries, args.solver, factorize)
+    #the solves of each side of each interval so far, over the rounds
+    solves = {out: (list[SolveResult](), list[SolveResult]()) for out in pending}
+
+    for rnd in range(args.rounds):
+        if not pending:
+            break
+        if args.rounds > 1:
+            print(f'\nround {rnd + 1} of {args.rounds}, {len(pending)} queries')
+        for k, out in enumerate(pending):
+            obj_name = f'obj_{out}'
+            linear = out in ctx.linear_objectives
+
+            print(f'\noptimizing {obj_name}' + (' (LP)' if linear else ''))
+
+            objective = ctx.problem.get_var_by_name(obj_name)
+            if decompose:
+                #classes the expression doesn't use are independent of it, solve without them
+                sub, var_map = get_objective_submodel(ctx, out)
+                print(f'\tsubmodel: {sub.num_vars()}/{ctx.problem.num_vars()} vars, '
+                      f'{len(sub.row_names)}/{len(ctx.problem.row_names)} linear, '
+                      f'{len(sub.prod_names)}/{len(ctx.problem.prod_names)} bilinear constraints')
+                solver = solver_backends[args.solver](sub)
+                objective = var_map[objective]
+
+            mins, maxs = solves[out]
+            #a side found exactly in an earlier round is not solved again
+            if not any(r.optimal for r in mins):
+                limit = solve_time_limit(args.time_limit, deadline, rnd, args.rounds, 2 * (len(pending) - k))
+                r = solver.solve(objective, MINIMIZE, linear, limit)
+                record_solve(ctx, out, 'min', r)
+                mins.append(r)
+                if r.optimal:
+                    print(f'\tOptimal min {r.obj_val}')
+                    opt_runtime += r.runtime
+                else:
+                    print_unsolved(r)
+                node_count += r.node_count
+
+            if early_stop and not any(r.optimal for r in maxs):
+                upper = trivial_upper_bound(ctx, ctx.expressions[out])
+                lower = side_bound(mins, MINIMIZE, upper)[0]
+                if lower != -1 and lower >= upper - BOUND_TOL:
+                    #the min already meets an upper bound, so the interval is a point
+                    print(f'\tmin meets the trivial upper bound {upper}, skipping max')
+                    for rs in (mins, maxs):
+                        rs.append(SolveResult('OPTIMAL', upper, obj_bound=upper))
+            if not any(r.optimal for r in maxs):
+                limit = solve_time_limit(args.time_limit, deadline, rnd, args.rounds, 2 * (len(pending) - k) - 1)
+                r = solver.solve(objective, MAXIMIZE, linear, limit)
+                record_solve(ctx, out, 'max', r)
+                maxs.append(r)
+                if r.optimal:
+                    print(f'\tOptimal Max {r.obj_val}')
+                    print(f'{r.runtime} seconds')
+                    opt_runtime += r.runtime
+                else:
+                    print_unsolved(r)
+                node_count += r.node_count
+
+            results[out], relaxed, inner = query_interval(ctx, out, *solves[out])
+            if relaxed:
+                ctx.relaxed[out] = inner
+            else:
+                ctx.relaxed.pop(out, None)
+            min, max = results[out]
+
+            #the interval is implied by the constraints, so it can be put on the objective var for free
+            #   to help the bounding of later solves that share its aux vars (on the monolithic model)
+            if not decompose and not relaxed and min != -1 and max != -1 and min <= max + 2 * BOUND_TOL:
+                solver.set_var_bounds(objective,
+                                      0 if min < BOUND_TOL else min - BOUND_TOL,
+                                      1 if max > 1 - BOUND_TOL else max + BOUND_TOL)
+        pending = [out for out in pending if out in ctx.relaxed]
+
+    copy_shared(ctx, results, same_as)
+    #in the order of the queries, keeping the intervals of the ones not solved again
+    ctx.results = {out: results[out] if out in results else ctx.results[out] for out in ctx.get_queries()}
+    
+    print(f'total optimization runtime: {opt_runtime} seconds, {node_count} branch-and-bound nodes')
+    if ctx.relaxed:
+        print(f'{len(ctx.relaxed)} intervals relaxed (out of time), see results.txt')
+
+def plan_solves(ctx: Context, queries: list[str], solver_name: str, factorize: bool) -> Tuple[dict[str, Tuple[float, float]], list[str], dict[str, str]]:
+    """splits queries into the ones answered without the global solver (see direct_value and
+    factorized_bounds), the ones to solve, and the ones whose expression is identical to that of
+    an earlier query (mapped to it), which share its interval"""
+    answered = dict[str, Tuple[float, float]]()
+    pending = list[str]()
+    same_as = dict[str, str]()
+    first = dict[tuple, str]()
+    for out in queries:
+        e = ctx.expressions[out]
+        key = expression_key(e)
+        if key in first:
+            same_as[out] = first[key]
+            ctx.solve_stats[out] = {'same_as': first[key]}
+            continue
+        first[key] = out
+
+        value = direct_value(ctx, e, solver_name)
+        if value is not None:
+            print(f'\nobj_{out} is fixed by an input constraint, {value}')
+            ctx.solve_stats[out] = {'direct': {'status': 'OPTIMAL', 'min': value, 'max': value}}
+            answered[out] = (value, value)
+            continue
+        if factorize and out not in ctx.linear_objectives:
+            bounds = factorized_bounds(ctx, e, solver_name)
+            if bounds is not None:
+                print(f'\nobj_{out} factorizes across its classes, [{bounds[0]},{bounds[1]}]')
+                ctx.solve_stats[out] = {'factorized': {'status': 'OPTIMAL', 'min': bounds[0], 'max': bounds[1]}}
+                answered[out] = bounds
+                continue
+        pending.append(out)
+    if same_as:
+        print(f'{len(same_as)} queries have the same expression as another one, solved once')
+    return answered, pending, same_as
+
+def copy_shared(ctx: Context, results: dict[str, Tuple[float, float]], same_as: dict[str, str]):
+    """gives the queries of plan_solves that share an expression the interval of the first one"""
+    for out, first in same_as.items():
+        results[out] = results[first]
+        if first in ctx.relaxed:
+            ctx.relaxed[out] = ctx.relaxed[first]
         else:
-            print(m.Status)
-
-        m.setObjective(objective, GRB.MAXIMIZE)
-        #m.write(f'{output_dir}/LPs/max_{obj_name}.lp')
-        m.optimize()
-        if m.status == GRB.Status.OPTIMAL:
-            max = m.ObjVal
-            print(f'\tOptimal Max {max}')
-            print(f'{m.Runtime} seconds')
-            opt_runtime += m.Runtime
+            ctx.relaxed.pop(out, None)
+
+def expression_key(e) -> tuple:
+    """canonical form of an expression, its (sym var ids, coefficient) terms in sorted order.
+    coefficients are rounded, so that the same sum reached in a different order still matches"""
+    return tuple(sorted((tuple(sorted(sv.id for sv in sym_vars)), round(float(v), 12))
+                        for sym_vars, v in e.iter_terms() if v != 0))
+
+def direct_value(ctx: Context, e, solver_name: str) -> float:
+    """the value of an expression that is c times the sym vars of one INPUTFACT row (c * P(f)),
+    or of a whole class (c, by SUMONE), None for any other expression. the row only fixes the
+    value if the class' constraints can be met at all, so an infeasible class (e.g. d|b = 1 with
+    P(d) < P(b)) is left to the solver, which reports it"""
+    classes = e.get_correlation_classes_used()
+    if len(classes) != 1:
+        return None
+    cl = next(iter(classes))
+    coeffs = set[float]()
+    vars = set[int]()
+    for sym_vars, v in e.iter_terms():
+        if v == 0:
+            continue
+        if len(sym_vars) != 1:
+            return None
+        coeffs.add(float(v))
+        vars.add(sym_vars[0].var)
+        if len(coeffs) > 1:
+            return None
+    if len(coeffs) == 0:
+        return None
+    c = coeffs.pop()
+    if len(vars) == len(cl.sym_vars):
+        value = c
+    else:
+        facts = [f for f, s in cl.fact_sums.items() if len(s) == len(vars) and s.keys() == vars]
+        if not facts:
+            return None
+        value = c * float(ctx.facts[facts[0]])
+    return value if class_feasible(ctx, cl, solver_name) else None
+
+def solve_time_limit(time_limit: float, deadline: float, rnd: int, rounds: int, solves_left: int) -> float:
+    """time limit of the next solve: the per-solve limit and an even share of what is left of the
+    run budget (until deadline), halved for every refinement round still to come. None: no limit"""
+    limits = list[float]()
+    if time_limit is not None:
+        limits.append(time_limit)
+    if deadline is not None:
+        limits.append(max(0.0, deadline - time.perf_counter()) / max(1, solves_left))
+    if not limits:
+        return None
+    return min(limits) / 2 ** (rounds - 1 - rnd)
+
+def side_bound(rs: list[SolveResult], sense: int, upper: float) -> Tuple[float, str, float]:
+    """one side of an interval from its solves (one per round): the bound, how it was found
+    ('exact', 'relaxed' or 'failed', for -1) and the best feasible value found
+
+    a solve stopped by a limit still bounds the optimum by the solver's dual bound, or failing
+    that by the trivial bounds 0 and upper (see trivial_upper_bound). the feasible values are
+    attained, so they bound it from the other side"""
+    for r in rs:
+        if r.optimal:
+            return r.obj_val, 'exact', r.obj_val
+    limited = [r for r in rs if r.limited]
+    if not limited:
+        return -1, 'failed', None
+    bounds = [r.obj_bound for r in limited if r.obj_bound is not None]
+    found = [r.obj_val for r in limited if r.obj_val is not None]
+    if sense == MINIMIZE:
+        return max(bounds + [0.0]), 'relaxed', min(found) if found else None
+    return min(bounds + [upper]), 'relaxed', max(found) if found else None
+
+def query_interval(ctx: Context, out: str, mins: list[SolveResult], maxs: list[SolveResult]) -> Tuple[Tuple[float, float], bool, Tuple[float, float]]:
+    """the interval of an output fact from the solves of its min and max problem, whether it is
+    relaxed (an outer interval of the exact one), and then the inner interval the feasible values
+    found span (None if a side has none)"""
+    #only needed for a max problem that didn't finish
+    upper = 1.0 if any(r.optimal for r in maxs) else trivial_upper_bound(ctx, ctx.expressions[out])
+    lo, lo_how, lo_found = side_bound(mins, MINIMIZE, upper)
+    hi, hi_how, hi_found = side_bound(maxs, MAXIMIZE, upper)
+    relaxed = 'relaxed' in (lo_how, hi_how)
+    inner = (lo_found, hi_found) if relaxed and lo_found is not None and hi_found is not None else None
+    return (lo, hi), relaxed, inner
+
+def print_unsolved(r: SolveResult):
+    if r.limited:
+        print(f'\t{r.status}, best found {r.obj_val}, bound {r.obj_bound} ({r.runtime} seconds)')
+    else:
+        print(r.status)
+
+def record_solve(ctx: Context, out: str, label: str, r: SolveResult):
+    ctx.solve_stats.setdefault(out, {})[label] = {
+        'status': r.status, 'obj_val': r.obj_val, 'obj_bound': r.obj_bound, 'runtime': r.runtime,
+        'node_count': r.node_count}
+
+def get_objective_submodel(ctx: Context, out: str) -> Tuple[Problem, dict[int, int]]:
+    """the part of the problem obj_<out> depends on: the constraints of the correlation classes its
+    expression uses, its own definition and the aux vars in it"""
+    groups = list(dict.fromkeys(cl.group for cl in ctx.expressions[out].get_correlation_classes_used()))
+    groups.append(f'obj_{out}')
+    return ctx.problem.restrict(groups, [ctx.problem.get_var_by_name(f'obj_{out}')])
+
+#slack used when comparing or reusing bounds found by the solver
+BOUND_TOL = 1e-6
+
+def trivial_upper_bound(ctx: Context, e) -> float:
+    """cheap upper bound on an expression that only uses the INPUTFACT constraints
+
+    every term is a product over distinct correlation classes, so the whole sum is at most
+    (largest coefficient) * (sum of the sym vars a term uses in any one class), and that sum
+    is at most P(f) if f holds in all of those worlds, or 1 - P(f) if it holds in none"""
+    max_coeff = 0
+    support = dict[CorrelationClass, set[int]]()
+    for sym_vars, v in e.iter_terms():
+        max_coeff = v if v > max_coeff else max_coeff
+        for sv in sym_vars:
+            support.setdefault(sv.corr_class, set()).add(sv.world)
+
+    bound = 1
+    for cl, worlds in support.items():
+        for f in cl.facts:
+            mask = cl.get_mask_of_fact(f)
+            holds = [w & mask != 0 for w in worlds]
+            if all(holds) and ctx.facts[f] < bound:
+                bound = ctx.facts[f]
+            elif not any(holds) and 1 - ctx.facts[f] < bound:
+                bound = 1 - ctx.facts[f]
+
+    bound = float(max_coeff) * float(bound)
+    return 1.0 if bound > 1 else bound
+
+#largest coefficient tensor (product of the class sizes) tried for factorization
+FACTOR_MAX_TERMS = 1 << 22
+
+def factorized_bounds(ctx: Context, e, solver_name: str) -> Tuple[float, float]:
+    """the exact interval of a multilinear expression that factors across its classes, None if
+    it doesn't
+
+    the classes are independent of each other (no constraint spans two of them), so when the
+    coefficient tensor (one axis per class) splits as a product u (x) V or a sum u (+) V of a
+    single class axis and the rest, the interval of the expression is the product or sum of the
+    intervals of the parts: each ranges over its own polytope independently of the others, so the
+    extremes of the product are among the products of the extremes. the single class parts are
+    small LPs over that class, and the rest is split again"""
+    classes = sorted(e.get_correlation_classes_used(), key=lambda cl: cl.order)
+    shape = tuple(len(cl.sym_vars) for cl in classes)
+    if int(np.prod(shape)) > FACTOR_MAX_TERMS:
+        return None
+    axis = {cl: k for k, cl in enumerate(classes)}
+    t = np.zeros(shape)
+    for sym_vars, v in e.iter_terms():
+        idx = [0] * len(classes)
+        for sv in sym_vars:
+            idx[axis[sv.corr_class]] = sv.id - sv.corr_class.id_base
+        t[tuple(idx)] += float(v)
+    return tensor_bounds(ctx, t, classes, solver_name)
+
+def tensor_bounds(ctx: Context, t: np.ndarray, classes: list[CorrelationClass], solver_name: str) -> Tuple[float, float]:
+    if len(classes) == 1:
+        return class_bounds(ctx, classes[0], t, solver_name)
+
+    for k in range(len(classes)):
+        #the tensor as a matrix, rows over the worlds of class k and columns over the rest
+        m = np.moveaxis(t, k, 0).reshape(t.shape[k], -1)
+        rest = classes[:k] + classes[k + 1:]
+        rest_shape = t.shape[:k] + t.shape[k + 1:]
+        parts = split_product(m)
+        combine = interval_mul
+        if parts is None:
+            parts = split_sum(m)
+            combine = interval_add
+        if parts is None:
+            continue
+        u, v = parts
+        u_bounds = class_bounds(ctx, classes[k], u, solver_name)
+        v_bounds = tensor_bounds(ctx, v.reshape(rest_shape), rest, solver_name) if u_bounds is not None else None
+        if v_bounds is None:
+            #the rest doesn't factor after splitting off this axis, another axis may still work
+            continue
+        return combine(u_bounds, v_bounds)
+    return None
+
+def split_product(m: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """u, v with m == outer(u, v), or None"""
+    i, j = np.unravel_index(np.argmax(np.abs(m)), m.shape)
+    if m[i, j] == 0:
+        return m[:, 0], np.zeros(m.shape[1])
+    u, v = m[:, j], m[i, :] / m[i, j]
+    return (u, v) if np.allclose(np.outer(u, v), m, rtol=1e-9, atol=1e-12) else None
+
+def split_sum(m: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """u, v with m == u[:, None] + v[None, :], or None. the sym vars of a class sum to one (SUMONE),
+    so the sum of the parts is still an expression over all of the classes"""
+    u, v = m[:, 0], m[0, :] - m[0, 0]
+    return (u, v) if np.allclose(u[:, None] + v[None, :], m, rtol=1e-9, atol=1e-12) else None
+
+def interval_mul(a: Tuple[float, float], b: Tuple[float, float]) -> Tuple[float, float]:
+    p = [a[0] * b[0], a[0] * b[1], a[1] * b[0], a[1] * b[1]]
+    return (min(p), max(p))
+
+def interval_add(a: Tuple[float, float], b: Tuple[float, float]) -> Tuple[float, float]:
+    return (a[0] + b[0], a[1] + b[1])
+
+def class_solver(ctx: Context, cl: CorrelationClass, solver_name: str) -> Tuple[Solver, dict[int, int]]:
+    """the LP over the constraints of a single class, compiled once per class"""
+    if cl not in ctx.class_solvers:
+        #a clique table is constrained by the other tables of its class too
+        sub, var_map = ctx.problem.restrict([cl.group], [])
+        ctx.class_solvers[cl] = (solver_backends[solver_name](sub), var_map)
+    return ctx.class_solvers[cl]
+
+def class_feasible(ctx: Context, cl: CorrelationClass, solver_name: str) -> bool:
+    """whether the constraints of a class can be met, one LP with no objective per class"""
+    if cl not in ctx.class_feasible:
+        solver, _ = class_solver(ctx, cl, solver_name)
+        ctx.class_feasible[cl] = solver.solve_lin_sum({}, MINIMIZE).optimal
+    return ctx.class_feasible[cl]
+
+def class_bounds(ctx: Context, cl: CorrelationClass, coeffs: np.ndarray, solver_name: str) -> Tuple[float, float]:
+    """min and max of sum(coeffs[w] * V_w) over the worlds of a class, two LPs on the class'
+    own constraints. None if either fails"""
+    solver, var_map = class_solver(ctx, cl, solver_name)
+    objective = {var_map[sv.var]: float(c) for sv, c in zip(cl.sym_vars, coeffs) if c != 0}
+    bounds = list[float]()
+    for sense in (MINIMIZE, MAXIMIZE):
+        if len(objective) == 0:
+            bounds.append(0.0)
+            continue
+        r = solver.solve_lin_sum(objective, sense)
+        if not r.optimal:
+            return None
+        bounds.append(r.obj_val)
+    return (bounds[0], bounds[1])
+
+#the solver compiled by a worker process of run_optimize_parallel
+_worker_solver = None
+
+def _init_worker(problem: Problem, solver_name: str):
+    """compiles a private copy of the problem (e.g. with its own gurobi env) in a worker"""
+    global _worker_solver
+    _worker_solver = solver_backends[solver_name](problem)
+
+def _solve_jobs(jobs: list[Tuple[int, int, bool]], time_limit: float = None) -> list[SolveResult]:
+    """solves a batch of (objective, sense, linear) jobs on the worker's solver"""
+    return _worker_solver.solve_batch(jobs, time_limit)
+
+def _solve_submodel(solver_name: str, sub: Problem, jobs: list[Tuple[int, int, bool]], time_limit: float = None) -> list[SolveResult]:
+    """compiles an objective's submodel in a worker and solves its jobs on it"""
+    return solver_backends[solver_name](sub).solve_batch(jobs, time_limit)
+
+def run_optimize_parallel(ctx: Context, solver_name: str, jobs: int, decompose: bool, factorize: bool = True,
+                          time_limit: float = None, deadline: float = None, rounds: int = 1, queries: list[str] = None):
+    """same as run_optimize, but the min/max problems of all output facts are scheduled on
+    a pool of worker processes, each solving its own copy of the problem (or submodel). every
+    solve of a round gets the same time limit, the run budget being shared out over the workers"""
+
+    #answered here: objectives fixed by an input constraint, and ones that factor (from LPs over
+    #   single classes)
+    answered, pending, same_as = plan_solves(ctx, ctx.get_queries() if queries is None else queries, solver_name, factorize)
+    solves = {out: (list[SolveResult](), list[SolveResult]()) for out in pending}
+
+    #spawn rather than fork, a forked gurobi env is not safe to use
+    mp_ctx = multiprocessing.get_context('spawn')
+    intervals = dict[str, Tuple[float, float]]()
+    opt_runtime = 0
+    for rnd in range(rounds):
+        if not pending:
+            break
+        print(f'\noptimizing {len(pending)} objectives on {jobs} workers' + (f', round {rnd + 1} of {rounds}' if rounds > 1 else ''))
+        #a side found exactly in an earlier round is not solved again
+        all_jobs = list[Tuple[int, int, bool]]()
+        owners = list[Tuple[str, int]]()
+        for out in pending:
+            objective = ctx.problem.get_var_by_name(f'obj_{out}')
+            for side, sense in enumerate((MINIMIZE, MAXIMIZE)):
+                if not any(r.optimal for r in solves[out][side]):
+                    all_jobs.append((objective, sense, out in ctx.linear_objectives))
+                    owners.append((out, side))
+        limit = solve_time_limit(time_limit, deadline, rnd, rounds, -(-len(all_jobs) // jobs))
+
+        if decompose:
+            #one task per objective: its submodel plus its min and/or max job
+            with ProcessPoolExecutor(max_workers=jobs, mp_context=mp_ctx) as pool:
+                futures = list()
+                for out in pending:
+                    sub, var_map = get_objective_submodel(ctx, out)
+                    sub_jobs = [(var_map[obj], sense, linear) for (obj, sense, linear), (o, _) in zip(all_jobs, owners) if o == out]
+                    futures.append(pool.submit(_solve_submodel, solver_name, sub, sub_jobs, limit))
+                solved = [r for f in futures for r in f.result()]
         else:
-            print(m.Status)
-        
-        #store away results as a tuple
-        results[out] = (min, max)
+            #contiguous batches, so the min and max problem of an objective usually end up on the
+            #   same worker and the second one is warm started from the first
+            batch_size = -(-len(all_jobs) // jobs)
+            batches = [all_jobs[i:i + batch_size] for i in range(0, len(all_jobs), batch_size)]
 
-    ctx.results = results
-    
-    print(f'total optimization runtime: {opt_runtime} seconds')
+            with ProcessPoolExecutor(max_workers=jobs, mp_context=mp_ctx,
+                                     initializer=_init_worker, initargs=(ctx.problem, solver_name)) as pool:
+                #map keeps the order of the batches, regardless of completion order
+                solved = [r for batch in pool.map(_solve_jobs, batches, [limit] * len(batches)) for r in batch]
+
+        for r, (out, side) in zip(solved, owners):
+            label = ('min', 'max')[side]
+            record_solve(ctx, out, label, r)
+            solves[out][side].append(r)
+            if r.optimal:
+                print(f'\tobj_{out} optimal {label} {r.obj_val} ({r.runtime} seconds)')
+                opt_runtime += r.runtime
+            elif r.limited:
+                print(f'\tobj_{out} {label}: {r.status}, best found {r.obj_val}, bound {r.obj_bound}')
+            else:
+                print(f'\tobj_{out} {label}: {r.status}')
+        for out in pending:
+            intervals[out], relaxed, inner = query_interval(ctx, out, *solves[out])
+            if relaxed:
+                ctx.relaxed[out] = inner
+            else:
+                ctx.relaxed.pop(out, None)
+        pending = [out for out in pending if out in ctx.relaxed]
+
+    solved = answered | intervals
+    copy_shared(ctx, solved, same_as)
+    ctx.results = {out: solved[out] if out in solved else ctx.results[out] for out in ctx.get_queries()}
+
+    print(f'total optimization runtime: {opt_runtime} seconds (summed over workers)')
+    if ctx.relaxed:
+        print(f'{len(ctx.relaxed)} intervals relaxed (out of time), see results.txt')
+
+def rule_probs(ctx: Context) -> dict[Tuple[str, Tuple[str, ...]], Tuple[Decimal, int]]:
+    """(head, body) -> probability and position among the head's rules, None for a (head, body)
+    that appears more than once"""
+    probs = dict[Tuple[str, Tuple[str, ...]], Tuple[Decimal, int]]()
+    for deps in (ctx.fact_deps, ctx.output_deps):
+        for head, rules in deps.items():
+            for k, (body, p) in enumerate(rules):
+                key = (head, tuple(body))
+                probs[key] = None if key in probs else (p, k)
+    return probs
+
+def apply_scenario(ctx: Context, facts: dict[str, Decimal], rules: dict[Tuple[str, Tuple[str, ...]], Decimal]) -> list[int]:
+    """sets new fact marginals and rule probabilities on the built model, returns the rows changed
+
+    marginals only show up as right hand sides of the INPUTFACT rows and conditional probabilities
+    as coefficients of the INPUTDEP rows, so those are patched in place. a changed output rule
+    rebuilds the expressions downstream of it and the objective rows of the queries among them"""
+    problem = ctx.problem
+    rows = set[int]()
+    for f, p in facts.items():
+        if f not in ctx.facts:
+            sys.exit(f'scenario sets unknown fact {f}')
+        if ctx.facts[f] == p:
+            continue
+        ctx.facts[f] = p
+        #irrelevant facts (see select_queries) have no constraints
+        if f'c_{f}' in problem.row_index:
+            r = problem.get_row_by_name(f'c_{f}')
+            problem.set_row(r, dict(zip(problem.row_vars[r], problem.row_coeffs[r])), p)
+            rows.add(r)
+
+    known = rule_probs(ctx)
+    dirty_heads = set[str]()
+    for (head, body), p in rules.items():
+        if (head, body) not in known:
+            sys.exit(f'scenario sets {head} {";".join(body)}, which is not a rule (or a side-channel one)')
+        if known[(head, body)] is None:
+            sys.exit(f'scenario sets {head} {";".join(body)}, which appears more than once')
+        old, k = known[(head, body)]
+        if old == p:
+            continue
+        if head in ctx.fact_deps:
+            ctx.fact_deps[head][k] = (list(body), p)
+            name = f'c_dep_{head}_{k}'
+            if name in ctx.dep_sums:
+                lhs, dep_sum = ctx.dep_sums[name]
+                r = problem.get_row_by_name(name)
+                problem.set_row(r, lin_sub(lhs, scale_lin_sum(dep_sum, p)), 0)
+                rows.add(r)
+        else:
+            ctx.output_deps[head][k] = (list(body), p)
+            dirty_heads.add(head)
+
+    if dirty_heads:
+        rows.update(rebuild_downstream(ctx, dirty_heads)[0])
+    return sorted(rows)
+
+def rebuild_downstream(ctx: Context, changed: set[str]) -> Tuple[list[int], list[str]]:
+    """rebuilds bottom-up the expressions of the output facts that (transitively) use a changed
+    fact (an input fact with new sym vars or an output fact with changed rules), and the objective
+    rows of the queries among them. returns the objective rows and the rebuilt queries"""
+    dirty = set[str]()
+    rows = list[int]()
+    rebuilt = list[str]()
+    queries = set(ctx.get_queries())
+    for level in schedule_rules(ctx, ctx.get_queries()):
+        for f in level:
+            if f in changed or any(d in changed or d in dirty for (body, _) in ctx.output_deps[f] for d in body):
+                dirty.add(f)
+                ctx.expressions[f] = combine_rules(ctx.output_deps[f], {d: ctx.expressions[d] for (body, _) in ctx.output_deps[f] for d in body})
+                if f in queries:
+                    rows.append(add_objective(ctx, f))
+                    rebuilt.append(f)
+    return rows, rebuilt
+
+def apply_delta(ctx: Context, add_facts: dict[str, Decimal], remove_facts: set[str],
+                add_rules: list[Tuple[str, list[str], Decimal]], remove_rules: list[Tuple[str, list[str]]],
+                presolve: bool = True, cliques: bool = False) -> Tuple[list[int], list[str], list[str], Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """adds and removes input facts and rules (see parse_delta) on the built model, returns the
+    rows changed or added, the queries whose interval may have changed, the queries removed and
+    the maps of Problem.compact (to patch a compiled solver with, see Solver.update_problem)
+
+    only the correlation classes of the connected components the change touches are rebuilt: their
+    rows are removed (Problem.remove_group) and the components they split or merge into get fresh
+    classes and constraints. the other classes, and the expressions and objectives not downstream
+    of the change in the rule graph, are kept as they are. the problem is then compacted, so the
+    sym vars of the dropped classes and the aux vars no row uses anymore are gone as well"""
+    problem = ctx.problem
+    rows = set[int]()
+    #input facts whose component has to be rebuilt, and the output facts with changed rules
+    touched = set[str]()
+    dirty_heads = set[str]()
+
+    for head, body in remove_rules:
+        if head in ctx.output_deps:
+            rules = ctx.output_deps[head]
+            kept = [(b, p) for (b, p) in rules if b != body]
+            if len(kept) == len(rules):
+                sys.exit(f'delta removes {head} {";".join(body)}, which is not a rule')
+            if kept:
+                ctx.output_deps[head] = kept
+            else:
+                del ctx.output_deps[head]
+            dirty_heads.add(head)
+            #the output rules decide which facts of a class get expressions, and on which table
+            touched.update(d for d in body if d in ctx.facts)
+        else:
+            deps, sides = ctx.fact_deps.get(head, []), ctx.side_channels.get(head, [])
+            kept_deps, kept_sides = [(b, p) for (b, p) in deps if b != body], [b for b in sides if b != body]
+            if len(kept_deps) + len(kept_sides) == len(deps) + len(sides):
+                sys.exit(f'delta removes {head} {";".join(body)}, which is not a rule')
+            for table, kept in ((ctx.fact_deps, kept_deps), (ctx.side_channels, kept_sides)):
+                if kept:
+                    table[head] = kept
+                else:
+                    table.pop(head, None)
+            touched.update([head] + body)
+
+    for f in remove_facts:
+        if f not in ctx.facts:
+            sys.exit(f'delta removes {f}, which is not an input fact')
+        if f in ctx.fact_deps or f in ctx.side_channels:
+            sys.exit(f'delta removes {f}, but not its dependencies')
+        del ctx.facts[f]
+        touched.add(f)
+    for f, p in add_facts.items():
+        if f in ctx.facts or f in ctx.output_deps:
+            sys.exit(f'delta adds {f}, which already exists')
+        ctx.facts[f] = p
+        touched.add(f)
+
+    for head, body, p in add_rules:
+        if head in ctx.facts:
+            for d in body:
+                if d not in ctx.facts:
+                    sys.exit(f'delta adds {head} {";".join(body)}, dep {d} not a fact')
+            if p == -1:
+                ctx.side_channels.setdefault(head, []).append(body)
+            else:
+                ctx.fact_deps.setdefault(head, []).append((body, p))
+            touched.update([head] + body)
+        else:
+            ctx.output_deps.setdefault(head, []).append((body, p))
+            dirty_heads.add(head)
+            touched.update(d for d in body if d in ctx.facts)
+
+    if cliques and dirty_heads:
+        #a changed rule can join the groups of input facts that have to share a table
+        groups = get_rule_groups(ctx)
+        joined = {groups[f] for f in dirty_heads if f in groups}
+        touched.update(f for f, g in groups.items() if g in joined and f in ctx.facts)
+
+    removed_queries = [f for f in dirty_heads if f not in ctx.output_deps and f'c_obj_{f}' in problem.row_index]
+    if ctx.queries is not None:
+        for q in ctx.queries:
+            if q not in ctx.output_deps:
+                sys.exit(f'delta removes the rules of query {q}')
+        #classes can come into or drop out of the cone of influence
+        relevant = {f for f in query_cone(ctx) if f in ctx.facts}
+        touched |= relevant ^ ctx.relevant_facts
+        ctx.relevant_facts = relevant
+
+    #the touched components, and what they split or merge into
+    component_of = {f: i for i, cc in enumerate(ctx.fact_components) for f in cc}
+    hit = {component_of[f] for f in touched if f in component_of}
+    old_facts = [f for i in sorted(hit) for f in ctx.fact_components[i]]
+    affected = list(dict.fromkeys([f for f in old_facts if f in ctx.facts] + [f for f in touched if f in ctx.facts]))
+    parent = {f: f for f in affected}
+    def find(f: str) -> str:
+        while parent[f] != f:
+            parent[f] = parent[parent[f]]
+            f = parent[f]
+        return f
+    for f in affected:
+        for body in [b for (b, _) in ctx.fact_deps.get(f, [])] + ctx.side_channels.get(f, []):
+            for d in body:
+                if d not in parent:
+                    sys.exit(f'{f} {";".join(body)}: dep {d} not a fact')
+                parent[find(d)] = find(f)
+    components = dict[str, list[str]]()
+    for f in affected:
+        components.setdefault(find(f), []).append(f)
+    ctx.fact_components = [cc for i, cc in enumerate(ctx.fact_components) if i not in hit] + list(components.values())
+
+    #drop the classes of the touched components
+    dropped = {ctx.fact_to_class[f] for f in old_facts if f in ctx.fact_to_class}
+    for cl in dropped:
+        for r in problem.remove_group(cl.get_name()):
+            ctx.dep_sums.pop(problem.row_names[r], None)
+            rows.add(r)
+        ctx.correlation_classes.discard(cl)
+        for t in [cl] + ctx.clique_tables.get(cl, []):
+            ctx.class_solvers.pop(t, None)
+            ctx.class_feasible.pop(t, None)
+        ctx.clique_tables.pop(cl, None)
+        ctx.clique_edges.pop(cl, None)
+    for f in old_facts:
+        ctx.fact_to_class.pop(f, None)
+        ctx.expressions.discard(f)
+
+    num_rows = len(problem.row_names)
+    groups = get_rule_groups(ctx)
+    built = list[CorrelationClass]()
+    for cc in components.values():
+        cl = build_class(ctx, cc, f'V{ctx.class_count}', presolve, cliques, groups)
+        ctx.class_count += 1
+        if cl is not None:
+            built.append(cl)
+    build_constraints(ctx, built)
+    rows.update(range(num_rows, len(problem.row_names)))
+    print(f'delta: {len(dropped)} correlation classes dropped, {len(built)} built')
+
+    for f in removed_queries:
+        rows.update(problem.remove_group(f'obj_{f}'))
+        ctx.expressions.discard(f)
+        ctx.linear_objectives.discard(f)
+        for table in (ctx.results, ctx.relaxed, ctx.solve_stats):
+            table.pop(f, None)
+
+    obj_rows, queries = rebuild_downstream(ctx, (dirty_heads - set(removed_queries)) | set(old_facts) | touched)
+    rows.update(obj_rows)
+    maps = compact_problem(ctx)
+    row_map = maps[1]
+    return sorted(int(row_map[r]) for r in rows if row_map[r] >= 0), queries, removed_queries, maps
+
+def compact_problem(ctx: Context) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """compacts the problem (see Problem.compact) and moves everything that refers to its vars
+    by index over to the new ones. returns the maps of Problem.compact"""
+    var_map, row_map, prod_map = ctx.problem.compact()
+    def remap(s: LinSum) -> LinSum:
+        return {int(var_map[v]): c for v, c in s.items()}
+    for cl in ctx.correlation_classes:
+        for t in [cl] + ctx.clique_tables.get(cl, []):
+            for sv in t.sym_vars:
+                sv.var = int(var_map[sv.var])
+            t.fact_sums = {f: remap(s) for f, s in t.fact_sums.items()}
+    ctx.products = {k: int(var_map[v]) for k, v in ctx.products.items() if var_map[v] >= 0}
+    ctx.dep_sums = {name: (remap(lhs), remap(dep_sum)) for name, (lhs, dep_sum) in ctx.dep_sums.items()}
+    ctx.class_solvers = {cl: (solver, {int(var_map[v]): i for v, i in sub_map.items()})
+                         for cl, (solver, sub_map) in ctx.class_solvers.items()}
+    return var_map, row_map, prod_map
+
+def scenario_files(paths: list[str]) -> list[str]:
+    """the given files, with directories expanded to the files in them"""
+    files = list[str]()
+    for p in paths:
+        if os.path.isdir(p):
+            files.extend(os.path.join(p, f) for f in sorted(os.listdir(p)) if os.path.isfile(os.path.join(p, f)))
+        else:
+            files.append(p)
+    return files
+
+def run_scenarios(ctx: Context, gb, paths: list[str]):
+    """re-solves the queries for every scenario file (see parse_scenario) on the model built
+    once: each scenario is applied to the base inputs with apply_scenario, and the compiled
+    solver is patched rather than rebuilt, so solves are warm started from the previous one"""
+    args = getattr(gb, 'args')
+    problem = ctx.problem
+    solver = ctx.solver if ctx.solver is not None else solver_backends[args.solver](problem)
+    base_facts = dict(ctx.facts)
+    base_rules = {k: v[0] for k, v in rule_probs(ctx).items() if v is not None}
+    queries = ctx.get_queries()
+
+    #values a scenario set, that have to go back to the base inputs for the next one
+    touched_facts = set[str]()
+    touched_rules = set[Tuple[str, Tuple[str, ...]]]()
+    rows_out = ['scenario\t' + '\t'.join(queries)]
+    paths = scenario_files(paths)
+    print(f'\nsolving {len(paths)} scenarios')
+    for path in paths:
+        facts, rules = parse_scenario(path)
+        facts = {f: to_decimal(p) for f, p in facts.items()}
+        rules = {k: to_decimal(p) for k, p in rules.items()}
+        target_facts = {f: base_facts[f] for f in touched_facts} | facts
+        target_rules = {k: base_rules[k] for k in touched_rules} | rules
+        touched_facts, touched_rules = set(facts), set(rules)
+
+        start = time.perf_counter()
+        num_vars, num_products = problem.num_vars(), len(problem.prod_names)
+        rows = apply_scenario(ctx, target_facts, target_rules)
+        if problem.num_vars() != num_vars or len(problem.prod_names) != num_products:
+            #a rebuilt expression needed new aux vars, the solver has to start over
+            solver = solver_backends[args.solver](problem)
+        else:
+            solver.update_rows(rows)
+
+        #drop the bounds learned for the base inputs (see run_optimize) all at once, the ones of
+        #   queries not yet solved would otherwise still hold the shared vars to the base inputs
+        for out in queries:
+            solver.set_var_bounds(problem.get_var_by_name(f'obj_{out}'), 0, 1)
+
+        results = list[str]()
+        runtime = 0
+        for out in queries:
+            objective = problem.get_var_by_name(f'obj_{out}')
+            linear = out in ctx.linear_objectives
+            bounds = list[float]()
+            for sense in (MINIMIZE, MAXIMIZE):
+                r = solver.solve(objective, sense, linear)
+                runtime += r.runtime
+                bounds.append(r.obj_val if r.optimal else -1)
+            results.append(f'[{bounds[0]},{bounds[1]}]')
+
+        name = os.path.basename(path)
+        print(f'\t{name}: {len(rows)} rows changed, solved in {runtime} seconds ({time.perf_counter() - start} seconds total)')
+        rows_out.append(name + '\t' + '\t'.join(results))
+
+    with open(os.path.join(args.outdir, 'scenarios.txt'), 'w') as f:
+        f.write('\n'.join(rows_out))
+
+def run_deltas(ctx: Context, gb, paths: list[str], presolve: bool):
+    """applies the delta files (see parse_delta) one after the other to the built model, and
+    re-solves the queries each one changes, one line per changed interval in <outdir>/deltas.txt"""
+    args = getattr(gb, 'args')
+    lines = list[str]()
+    paths = scenario_files(paths)
+    print(f'\napplying {len(paths)} deltas')
+    for path in paths:
+        add_facts, remove_facts, add_rules, remove_rules = parse_delta(path)
+        start = time.perf_counter()
+        rows, queries, removed, maps = apply_delta(ctx, {f: to_decimal(p) for f, p in add_facts.items()}, remove_facts,
+                                                   [(h, b, to_decimal(p)) for (h, b, p) in add_rules], remove_rules,
+                                                   presolve, args.cliques)
+        if ctx.solver is not None:
+            #patch the compiled monolithic model, and drop the bounds learned (see run_optimize)
+            #   for the objectives to solve again
+            ctx.solver.update_problem(*maps, rows)
+            for out in queries:
+                ctx.solver.set_var_bounds(ctx.problem.get_var_by_name(f'obj_{out}'), 0, 1)
+        build_time = time.perf_counter() - start
+        run_optimize(ctx, gb, queries)
+
+        name = os.path.basename(path)
+        print(f'\t{name}: {len(rows)} rows changed, {len(queries)} queries re-solved, {len(removed)} removed '
+              f'(model patched in {build_time} seconds, {time.perf_counter() - start} seconds total)')
+        for out in queries:
+            v = ctx.results[out]
+            lines.append(f'{name}\t{out}\t[{v[0]},{v[1]}]' + ('\trelaxed' if out in ctx.relaxed else ''))
+        lines.extend(f'{name}\t{out}\tremoved' for out in removed)
+
+    with open(os.path.join(args.outdir, 'deltas.txt'), 'w') as f:
+        f.write('\n'.join(lines))
 
 def process_results(ctx: Context, gb):
     results = ctx.results
@@ -284,6 +1387,10 @@ def process_results(ctx: Context, gb):
     output_exprs = list[str]()
     for k, v in results.items():
         s = f'{k}\t[{v[0]},{v[1]}]'
+        if k in ctx.relaxed:
+            #an outer interval, then the values actually attained (if the solver found any)
+            inner = ctx.relaxed[k]
+            s += '\trelaxed' + (f'\t[{inner[0]},{inner[1]}]' if inner is not None else '')
         output_strs.append(s)
         output_exprs.append(f'{k}\t{str(ctx.expressions[k])}')
     